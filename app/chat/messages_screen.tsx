@@ -7,7 +7,7 @@ import { useChat } from "@/context/chat_context";
 import { useProfileAndSettings } from "@/context/profile_context";
 import { update_message_archive_state } from "@/services/API/archive_services";
 import { regenerate_model_response, sent_new_message } from "@/services/API/chat_services";
-import { send_rag_candidate_to_db } from "@/services/API/rag_services";
+import { send_rag_candidate_to_db, wait_for_rag_job } from "@/services/API/rag_services";
 import getFormattedTimestamp from "@/utils/time_stamp";
 import get_chat_title from "@/utils/title_extractor";
 import { useTheme } from "next-themes";
@@ -98,10 +98,14 @@ export default function MessagesScreen() {
     updateMessagesList(placeholderAssistant);
     setIsWaitingResponse(true);
 
-    // upload the rag file
+    // upload the rag file and wait until it is indexed so the rag turn can find it
     if (formData) {
         const rag_res = await send_rag_candidate_to_db(formData)
-        if (rag_res.success) {
+        if (!rag_res.success) {
+            return;
+        }
+        const job_res = await wait_for_rag_job(rag_res.data)
+        if (job_res.success) {
             console.log("uploaded")
         } else {
             return;
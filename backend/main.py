@@ -1,13 +1,10 @@
 import json
-import io
 import os
 import random
+from contextlib import asynccontextmanager
 from typing import List, Optional
 
-import docx
-import openpyxl
-import PyPDF2
-from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi import BackgroundTasks, Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
@@ -21,6 +18,8 @@ from utils.title_extractor import extract_title_block
 from model.api_called import GeminiAgent
 from prompts.chat_prompt import build_context
 from services.library_services import RAGServices
+from services.extraction import ExtractionError
+from services.ingestion_jobs import IngestionJobs
 from services.memory_services import MemoryServices
 from utils.python_file import generate_text, generate_docx, generate_excel, generate_pdf
 from link_services import get_all_urls_metadata
@@ -29,11 +28,27 @@ from global_storage import set_app_storage_dir, get_app_storage_dir
 from Types.profile_type import EditProfileData, ProfileData
 from files_services import check_if_userprofile_exists, load_userProfile_json, update_userProfile_json, create_userProfile_json
 from services.chat_services import ChatServices
+from services.service_registry import ServiceRegistry, get_chat_services, get_ingestion_jobs, get_memory_services, get_rag_services
+from services.embeddings import load_embedding_settings, save_embedding_settings
 
 # Initialize services
 model_manager = ModelManager()
 gemini_api_key = os.environ.get("GEMINI_API_KEY", "")
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the shared services once and close them on shutdown"""
+    registry = ServiceRegistry()
+    registry.start()
+    app.state.services = registry
+    try:
+        yield
+    finally:
+        registry.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS Middleware
 app.add_middleware(
@@ -198,10 +213,9 @@ async def create_user_file(request: Request):
 
 # ================== CHAT MANAGEMENT ROUTES ==================
 @app.post("/chat/new")
-async def create_new_chat():
+async def create_new_chat(chat_services: ChatServices = Depends(get_chat_services)):
     """Create a new chat room"""
     try:
-        chat_services = ChatServices()
         chat_id = chat_services.create_new_entry()
         
         if not chat_id:
@@ -215,7 +229,7 @@ async def create_new_chat():
 
 
 @app.put("/chat/rename")
-async def rename_chat(chat_id: int, new_name: str):
+async def rename_chat(chat_id: int, new_name: str, chat_services: ChatServices = Depends(get_chat_services)):
     """Rename a chat room"""
     try:
         if chat_id <= 0:
@@ -224,7 +238,6 @@ async def rename_chat(chat_id: int, new_name: str):
         if not new_name.strip():
             return {"status": "failed", "message": "New name cannot be empty"}
         
-        chat_services = ChatServices()
         result = chat_services.update_chat_title(chat_id, new_title=new_name)
         return {"status": "success", "message": result}
     
@@ -234,10 +247,9 @@ async def rename_chat(chat_id: int, new_name: str):
 
 
 @app.get("/chat/load-all")
-def load_all_chats():
+def load_all_chats(chat_services: ChatServices = Depends(get_chat_services)):
     """Load all chat rooms"""
     try:
-        chat_services = ChatServices()
         result = chat_services.load_chats_list()
         return {"status": "success", "message": result}
     
@@ -247,13 +259,12 @@ def load_all_chats():
 
 
 @app.delete("/chat/delete-one")
-def delete_chat(chat_id: int):
+def delete_chat(chat_id: int, chat_services: ChatServices = Depends(get_chat_services)):
     """Delete a chat item"""
     try:
         if chat_id <= 0:
             return {"status": "failed", "message": "Invalid chat ID"}
         
-        chat_services = ChatServices()
         result = chat_services.delete_chat_entry(chat_id)
         return {"status": "success", "message": result}
     
@@ -263,13 +274,12 @@ def delete_chat(chat_id: int):
 
 
 @app.put("/chat/archive")
-def toggle_chat_archive(current_archive_state: bool, chat_id: int):
+def toggle_chat_archive(current_archive_state: bool, chat_id: int, chat_services: ChatServices = Depends(get_chat_services)):
     """Toggle archive state for chat"""
     try:
         if chat_id <= 0:
             return {"status": "failed", "message": "Invalid chat ID"}
         
-        chat_services = ChatServices()
         result = chat_services.toggle_archive_chat(
             chat_id, 
             current_state=1 if current_archive_state else 0
@@ -282,13 +292,12 @@ def toggle_chat_archive(current_archive_state: bool, chat_id: int):
 
 
 @app.get("/chat/search")
-def search_chats(query: str):
+def search_chats(query: str, chat_services: ChatServices = Depends(get_chat_services)):
     """Search for chats"""
     try:
         if not query.strip():
             return {"status": "failed", "message": "Search query cannot be empty"}
         
-        chat_services = ChatServices()
         result = chat_services.search_for_chat(query)
         
         if not result:
@@ -302,10 +311,9 @@ def search_chats(query: str):
 
 
 @app.get("/chat/load-archived")
-def load_archived_chats():
+def load_archived_chats(chat_services: ChatServices = Depends(get_chat_services)):
     """Load archived chat rooms"""
     try:
-        chat_services = ChatServices()
         result = chat_services.load_all_archived_chats()
         return {"status": "success", "message": result}
     
@@ -315,13 +323,12 @@ def load_archived_chats():
 
 
 @app.get("/chat/save")
-def save_chat(chat_id: int):
+def save_chat(chat_id: int, chat_services: ChatServices = Depends(get_chat_services)):
     """Save chat locally"""
     try:
         if chat_id <= 0:
             return {"status": "failed", "message": "Invalid chat ID"}
         
-        chat_services = ChatServices()
         result = chat_services.save_chat_locally(chat_id)
         return {"status": "success", "message": result}
     
@@ -332,7 +339,7 @@ def save_chat(chat_id: int):
 
 # ================== MESSAGES ROUTES ==================
 @app.post("/messages/new")
-async def create_new_messages(chat_id: int, request: Request):
+async def create_new_messages(chat_id: int, request: Request, chat_services: ChatServices = Depends(get_chat_services)):
     """Save new message and model reply"""
     try:
         if chat_id <= 0:
@@ -345,7 +352,6 @@ async def create_new_messages(chat_id: int, request: Request):
         if not user_message or not model_message:
             return {"status": "failed", "message": "Missing message content"}
         
-        chat_services = ChatServices()
         result = chat_services.create_new_message_entry(user_message, model_message, chat_id)
         return {"status": "success", "message": result}
     
@@ -355,13 +361,12 @@ async def create_new_messages(chat_id: int, request: Request):
 
 
 @app.get("/messages/get-prev-context")
-def get_previous_context(chat_id: int, original_message_id: int):
+def get_previous_context(chat_id: int, original_message_id: int, chat_services: ChatServices = Depends(get_chat_services)):
     """Get previous context for message regeneration"""
     try:
         if chat_id <= 0 or original_message_id <= 0:
             return {"status": "failed", "message": "Invalid ID provided"}
         
-        chat_services = ChatServices()
         old_context = chat_services.get_context_for_regeneration(chat_id, original_message_id)
         
         if not old_context:
@@ -375,7 +380,7 @@ def get_previous_context(chat_id: int, original_message_id: int):
 
 
 @app.post("/messages/regenerate")
-async def regenerate_message_endpoint(chat_id: int, original_message_id: int, original_reply_id: int, request: Request):
+async def regenerate_message_endpoint(chat_id: int, original_message_id: int, original_reply_id: int, request: Request, chat_services: ChatServices = Depends(get_chat_services)):
     """Regenerate a message"""
     try:
         if chat_id <= 0 or original_message_id <= 0 or original_reply_id <= 0:
@@ -388,7 +393,6 @@ async def regenerate_message_endpoint(chat_id: int, original_message_id: int, or
         if not user_message or not model_message:
             return {"status": "failed", "message": "Missing message content"}
         
-        chat_services = ChatServices()
         updated_messages = chat_services.regenerate_message(
             chat_id, user_message, model_message, original_message_id, original_reply_id
         )
@@ -404,13 +408,12 @@ async def regenerate_message_endpoint(chat_id: int, original_message_id: int, or
 
 
 @app.get("/messages/load-all")
-def load_all_messages(chat_id: int):
+def load_all_messages(chat_id: int, chat_services: ChatServices = Depends(get_chat_services)):
     """Load all messages for a chat"""
     try:
         if chat_id <= 0:
             return {"status": "failed", "message": "Invalid chat ID"}
         
-        chat_services = ChatServices()
         result = chat_services.load_all_chat_messages(chat_id)
         
         if not result:
@@ -424,14 +427,15 @@ def load_all_messages(chat_id: int):
 
 
 @app.get("/messages/search")
-def search_messages(query: str):
-    """Search for messages"""
+def search_messages(query: str, limit: int = 20, offset: int = 0, chat_services: ChatServices = Depends(get_chat_services)):
+    """Search for messages (best matches first, each with a highlighted snippet)"""
     try:
         if not query.strip():
             return {"status": "failed", "message": "Search query cannot be empty"}
+        if limit <= 0 or limit > 100:
+            limit = 20  # Set reasonable default
         
-        chat_services = ChatServices()
-        result = chat_services.search_for_message(query)
+        result = chat_services.search_for_message(query, limit=limit, offset=max(0, offset))
         
         if not result:
             return {"status": "failed", "message": "Couldn't find any messages that meet condition"}
@@ -444,13 +448,12 @@ def search_messages(query: str):
 
 
 @app.put('/messages/archive')
-def toggle_message_archive(current_archive_state: bool, message_id: int):
+def toggle_message_archive(current_archive_state: bool, message_id: int, chat_services: ChatServices = Depends(get_chat_services)):
     """Toggle archive state for a message"""
     try:
         if message_id <= 0:
             return {"status": "failed", "message": "Invalid message ID"}
         
-        chat_services = ChatServices()
         result = chat_services.toggle_archive_message(
             message_id, 
             current_state=1 if current_archive_state else 0
@@ -463,10 +466,9 @@ def toggle_message_archive(current_archive_state: bool, message_id: int):
 
 
 @app.get("/messages/load-archived")
-def load_archived_messages():
+def load_archived_messages(chat_services: ChatServices = Depends(get_chat_services)):
     """Load archived messages"""
     try:
-        chat_services = ChatServices()
         result = chat_services.load_all_archived_messages()
         return {"status": "success", "message": result}
     
@@ -477,10 +479,9 @@ def load_archived_messages():
 
 # ================== MEDIA ROUTES ==================
 @app.get("/media/load-all")
-async def load_all_media():
+async def load_all_media(chat_services: ChatServices = Depends(get_chat_services)):
     """Load all media from database"""
     try:
-        chat_services = ChatServices()
         data = chat_services.fetch_media_content()
         return {"status": "success", "message": data}
     
@@ -497,7 +498,12 @@ async def chat_with_model(
     useRag: bool, 
     request: Request, 
     mode: Optional[str] = None, 
-    action: Optional[str] = None
+    action: Optional[str] = None,
+    memory_scope: Optional[str] = None,
+    rag_scope: Optional[str] = None,
+    chat_services: ChatServices = Depends(get_chat_services),
+    rag_services: RAGServices = Depends(get_rag_services),
+    memory_services: MemoryServices = Depends(get_memory_services)
 ):
     """Create new chat message with AI model"""
     try:
@@ -510,11 +516,6 @@ async def chat_with_model(
         if not user_message:
             return {"status": "failed", "message": "Missing user message"}
         
-        # Initialize services
-        chat_services = ChatServices()
-        rag_services = RAGServices()
-        memory_services = MemoryServices()
-        
         old_context = []
         chat_item = None
         
@@ -539,7 +540,9 @@ async def chat_with_model(
             include_rag=useRag,
             mode=mode,
             user_settings=user_settings,
-            chat_id=chat_id
+            chat_id=chat_id,
+            memory_scope=memory_scope,
+            rag_scope=rag_scope
         )
         
         # Get model response
@@ -579,7 +582,15 @@ async def chat_with_model(
 
 
 @app.post("/model/chat/update")
-async def update_message_with_model(chat_id: int, original_message_id: int, original_reply_id: int, request: Request):
+async def update_message_with_model(
+    chat_id: int,
+    original_message_id: int,
+    original_reply_id: int,
+    request: Request,
+    chat_services: ChatServices = Depends(get_chat_services),
+    rag_services: RAGServices = Depends(get_rag_services),
+    memory_services: MemoryServices = Depends(get_memory_services)
+):
     """Update message with AI model"""
     try:
         if chat_id <= 0 or original_message_id <= 0 or original_reply_id <= 0:
@@ -591,15 +602,13 @@ async def update_message_with_model(chat_id: int, original_message_id: int, orig
         if not updated_message:
             return {"status": "failed", "message": "Missing updated message"}
         
-        # Get context and services
-        chat_services = ChatServices()
-        rag_services = RAGServices()
+        # Get context
         old_context = chat_services.get_context_for_regeneration(chat_id, original_message_id)
         
         # Build prompt
         prompt = build_context(
             chat_history=old_context,
-            memory_service=MemoryServices(),
+            memory_service=memory_services,
             library_service=rag_services,
             current_user_input=updated_message,
             chat_id=chat_id
@@ -632,7 +641,12 @@ async def regenerate_with_model(
     use_rag: bool, 
     request: Request,
     mode: Optional[str] = None, 
-    action: Optional[str] = None
+    action: Optional[str] = None,
+    memory_scope: Optional[str] = None,
+    rag_scope: Optional[str] = None,
+    chat_services: ChatServices = Depends(get_chat_services),
+    rag_services: RAGServices = Depends(get_rag_services),
+    memory_services: MemoryServices = Depends(get_memory_services)
 ):
     """Regenerate message with AI model"""
     try:
@@ -649,10 +663,7 @@ async def regenerate_with_model(
         
         create_input = f"user:{user_message} assistant:{model_reply} answer the user message in a different style and way try"
         
-        # Get context and services
-        chat_services = ChatServices()
-        rag_services = RAGServices()
-        memory_services = MemoryServices()
+        # Get context
         old_context = chat_services.get_context_for_regeneration(chat_id, original_message_id)
         
         # Build prompt
@@ -665,7 +676,9 @@ async def regenerate_with_model(
             need_title=False,
             mode=mode,
             include_rag=use_rag,
-            chat_id=chat_id
+            chat_id=chat_id,
+            memory_scope=memory_scope,
+            rag_scope=rag_scope
         )
         
         # Get model response
@@ -689,8 +702,8 @@ async def regenerate_with_model(
 
 # ================== RAG (Retrieval-Augmented Generation) ROUTES ==================
 @app.post("/rag/upload")
-async def upload_rag_file(metadata: str = Form(...), file: UploadFile = File(...)):
-    """Upload file for RAG processing"""
+def upload_rag_file(metadata: str = Form(...), file: UploadFile = File(...), jobs: IngestionJobs = Depends(get_ingestion_jobs)):
+    """Queue file for RAG processing, returns the ingestion job"""
     try:
         # Parse metadata
         try:
@@ -702,102 +715,115 @@ async def upload_rag_file(metadata: str = Form(...), file: UploadFile = File(...
         if not extension:
             return {"status": "failed", "message": "Missing file extension"}
         
-        # Read file content
-        raw_bytes = await file.read()
-        content = ""
-        
-        # Process different file types
-        if extension == "txt":
-            content = raw_bytes.decode("utf-8")
-        
-        elif extension == "json":
-            try:
-                parsed = json.loads(raw_bytes.decode("utf-8"))
-                content = json.dumps(parsed, indent=2)
-            except json.JSONDecodeError:
-                return {"status": "failed", "message": "Invalid JSON file"}
-        
-        elif extension == "docx":
-            try:
-                doc = docx.Document(io.BytesIO(raw_bytes))
-                content = "\n".join([p.text for p in doc.paragraphs])
-            except Exception:
-                return {"status": "failed", "message": "Failed to read DOCX file"}
-        
-        elif extension == "pdf":
-            try:
-                reader = PyPDF2.PdfReader(io.BytesIO(raw_bytes))
-                content = ""
-                for page in reader.pages:
-                    content += page.extract_text() or ""
-            except Exception:
-                return {"status": "failed", "message": "Failed to extract PDF text"}
-        
-        elif extension == "xlsx":
-            try:
-                wb = openpyxl.load_workbook(io.BytesIO(raw_bytes), read_only=True)
-                content = ""
-                for sheet in wb.worksheets:
-                    for row in sheet.iter_rows(values_only=True):
-                        content += "\t".join([str(cell) if cell is not None else "" for cell in row]) + "\n"
-            except Exception:
-                return {"status": "failed", "message": "Failed to read Excel file"}
-        
-        else:
-            return {"status": "failed", "message": f"Unsupported file type: {extension}"}
-        
-        # Save to database
-        rag_services = RAGServices()
-        rag_services.save_to_db(
-            file_text=content,
-            filename=meta.get("filename", file.filename or "unknown"),
-            extension=extension,
-            title=meta.get("title", ""),
-            is_isolated=meta.get("is_isolated", False),
-            chat_id=str(meta.get("chat_id", "")),
-            tags=meta.get("tags", "")
-        )
+        # A missing, null or empty chat id marks a global file (NULL in the db)
+        chat_id = meta.get("chat_id")
+        chat_id = None if chat_id in (None, "") else str(chat_id)
         
-        return {"status": "success"}
+        # Spool the upload and let an ingestion worker extract, chunk and embed it
+        try:
+            job = jobs.submit(
+                file.file,
+                filename=meta.get("filename", file.filename or "unknown"),
+                extension=extension,
+                title=meta.get("title", ""),
+                is_isolated=meta.get("is_isolated", False),
+                chat_id=chat_id,
+                tags=meta.get("tags", "")
+            )
+        except ExtractionError as e:
+            return {"status": "failed", "message": str(e)}
+        
+        return {"status": "success", "job_id": job["id"], "job": job}
     
     except Exception as e:
         print(f"Error uploading RAG file: {e}")
         return {"status": "failed", "message": "Failed to upload file"}
 
 
+@app.get("/rag/jobs")
+def list_rag_jobs(status: Optional[str] = None, limit: int = 100, jobs: IngestionJobs = Depends(get_ingestion_jobs)):
+    """List RAG ingestion jobs, newest first"""
+    try:
+        return {"status": "success", "jobs": jobs.list_jobs(status=status, limit=limit)}
+    except Exception as e:
+        print(f"Error listing RAG jobs: {e}")
+        return {"status": "failed", "message": "Failed to list jobs"}
+
+
+@app.get("/rag/jobs/{job_id}")
+def get_rag_job(job_id: str, jobs: IngestionJobs = Depends(get_ingestion_jobs)):
+    """Get the status and progress of a RAG ingestion job"""
+    try:
+        job = jobs.get_job(job_id)
+        if job is None:
+            return {"status": "failed", "message": "Job not found"}
+        return {"status": "success", "job": job}
+    except Exception as e:
+        print(f"Error reading RAG job: {e}")
+        return {"status": "failed", "message": "Failed to read job"}
+
+
+@app.post("/rag/jobs/{job_id}/cancel")
+def cancel_rag_job(job_id: str, jobs: IngestionJobs = Depends(get_ingestion_jobs)):
+    """Cancel a queued or running RAG ingestion job"""
+    try:
+        if not jobs.cancel(job_id):
+            return {"status": "failed", "message": "Job not found or already finished"}
+        return {"status": "success"}
+    except Exception as e:
+        print(f"Error cancelling RAG job: {e}")
+        return {"status": "failed", "message": "Failed to cancel job"}
+
+
 @app.get("/rag/files")
-def list_rag_files():
-    """List all RAG files"""
+def list_rag_files(rag_services: RAGServices = Depends(get_rag_services)):
+    """List all RAG files along with the query cache counters"""
     try:
-        rag_services = RAGServices()
-        return rag_services.load_all_rag_files()
+        result = rag_services.load_all_rag_files()
+        result["query_cache"] = rag_services.query_cache_stats()
+        return result
     except Exception as e:
         print(f"Error listing RAG files: {e}")
         return {"status": "failed", "message": "Failed to load RAG files"}
 
 
 @app.get("/rag/search")
-def search_rag(query: str):
-    """Search RAG database"""
+def search_rag(
+    query: str,
+    chat_id: Optional[str] = None,
+    scope: Optional[str] = None,
+    k: int = 3,
+    mode: Optional[str] = None,
+    vector_weight: Optional[float] = None,
+    keyword_weight: Optional[float] = None,
+    rag_services: RAGServices = Depends(get_rag_services)
+):
+    """Search RAG database (scope: chat, isolated or all / mode: vector, keyword or hybrid)"""
     try:
         if not query.strip():
             return {"status": "failed", "message": "Search query cannot be empty"}
         
-        rag_services = RAGServices()
-        return rag_services.rag_query(query)
+        return rag_services.rag_query(
+            query,
+            chat_id=chat_id,
+            k=k,
+            scope=scope,
+            mode=mode,
+            vector_weight=vector_weight,
+            keyword_weight=keyword_weight
+        )
     except Exception as e:
         print(f"Error searching RAG: {e}")
         return {"status": "failed", "message": "Failed to search RAG database"}
 
 
 @app.delete("/rag/files/delete/{file_id}")
-def delete_rag_file(file_id: int):
+def delete_rag_file(file_id: int, rag_services: RAGServices = Depends(get_rag_services)):
     """Delete a RAG file"""
     try:
         if file_id <= 0:
             return {"status": "failed", "message": "Invalid file ID"}
         
-        rag_services = RAGServices()
         rag_services.remove_file(file_id)
         return {"status": "deleted"}
     except Exception as e:
@@ -805,12 +831,21 @@ def delete_rag_file(file_id: int):
         return {"status": "failed", "message": "Failed to delete file"}
 
 
+@app.post("/rag/compact")
+def compact_rag_index(rag_services: RAGServices = Depends(get_rag_services)):
+    """Remove orphaned chunks and reclaim index and database space"""
+    try:
+        return {"status": "success", "message": rag_services.compact()}
+    except Exception as e:
+        print(f"Error compacting RAG index: {e}")
+        return {"status": "failed", "message": "Failed to compact RAG index"}
+
+
 # ================== MEMORY MANAGEMENT ROUTES ==================
 @app.get("/memories/all")
-def load_all_memories():
+def load_all_memories(memory_services: MemoryServices = Depends(get_memory_services)):
     """Load all memories"""
     try:
-        memory_services = MemoryServices()
         memories = memory_services.get_all()
         return {"status": "success", "message": memories}
     except Exception as e:
@@ -819,7 +854,7 @@ def load_all_memories():
 
 
 @app.put("/memories/update/{memory_id}")
-async def update_memory(memory_id: int, request: Request):
+async def update_memory(memory_id: int, request: Request, memory_services: MemoryServices = Depends(get_memory_services)):
     """Update existing memory"""
     try:
         if memory_id <= 0:
@@ -831,7 +866,6 @@ async def update_memory(memory_id: int, request: Request):
         if not new_memory_content:
             return {"status": "failed", "message": "Missing updated content"}
         
-        memory_services = MemoryServices()
         memory_services.update(memory_id, new_memory_content)
         return {"status": "success", "message": "updated"}
     except Exception as e:
@@ -840,13 +874,12 @@ async def update_memory(memory_id: int, request: Request):
 
 
 @app.delete("/memories/delete/{memory_id}")
-def delete_memory(memory_id: int):
+def delete_memory(memory_id: int, memory_services: MemoryServices = Depends(get_memory_services)):
     """Delete a memory"""
     try:
         if memory_id <= 0:
             return {"status": "failed", "message": "Invalid memory ID"}
         
-        memory_services = MemoryServices()
         memory_services.delete(memory_id)
         return {"status": "success", "message": "deleted"}
     except Exception as e:
@@ -855,7 +888,7 @@ def delete_memory(memory_id: int):
 
 
 @app.post("/memories/add")
-async def add_new_memory(request: Request):
+async def add_new_memory(request: Request, memory_services: MemoryServices = Depends(get_memory_services)):
     """Add new memory manually"""
     try:
         data = await request.json()
@@ -865,7 +898,6 @@ async def add_new_memory(request: Request):
         if not new_memory_content:
             return {"status": "failed", "message": "Missing memory content"}
         
-        memory_services = MemoryServices()
         item = memory_services.create_memory_manually(new_memory_content, new_memory_weight)
         return {"status": "success", "message": item}
     except Exception as e:
@@ -873,6 +905,35 @@ async def add_new_memory(request: Request):
         return {"status": "failed", "message": "Failed to add memory"}
 
 
+# ================== EMBEDDING SETTINGS ROUTES ==================
+@app.get("/embeddings/settings")
+def get_embedding_settings():
+    """Load the embedding backend settings"""
+    try:
+        return {"status": "success", "message": load_embedding_settings()}
+    except Exception as e:
+        print(f"Error loading embedding settings: {e}")
+        return {"status": "failed", "message": "Failed to load embedding settings"}
+
+
+@app.put("/embeddings/settings")
+async def update_embedding_settings(request: Request):
+    """Select the embedding backend (applied on the next start, stored vectors are re-embedded then)"""
+    try:
+        data = await request.json()
+        new_settings = data.get("settings")
+
+        if not new_settings:
+            return {"status": "failed", "message": "Missing settings"}
+
+        return {"status": "success", "message": save_embedding_settings(new_settings)}
+    except ValueError as e:
+        return {"status": "failed", "message": str(e)}
+    except Exception as e:
+        print(f"Error saving embedding settings: {e}")
+        return {"status": "failed", "message": "Failed to save embedding settings"}
+
+
 # ================== LOCAL MODELS MANAGEMENT ROUTES ==================
 @app.get("/api/models/huggingface", response_model=List[HuggingFaceModel])
 async def get_huggingface_models(
@@ -15,7 +15,9 @@ def build_context(
     mode: Optional[str],
     chat_id: str,
     user_settings: str,
-    include_rag: bool = False
+    include_rag: bool = False,
+    memory_scope: Optional[str] = None,
+    rag_scope: Optional[str] = None
 ) -> str:
     
     # Last N messages with better formatting
@@ -41,7 +43,7 @@ def build_context(
 
     # Memory recall with error handling
     try:
-        memory_hits = memory_service.fetch(query=current_user_input, chat_id=chat_id, k=10)
+        memory_hits = memory_service.fetch(query=current_user_input, chat_id=chat_id, k=10, scope=memory_scope)
         memory_context = "\n".join(memory_hits) if memory_hits else "No relevant memories found."
     except Exception:
         memory_context = "Memory service unavailable."
@@ -50,7 +52,7 @@ def build_context(
     rag_context = ""
     if include_rag:
         try:
-            rag_chunks = ragServices.rag_query(question=current_user_input, chat_id=chat_id)
+            rag_chunks = ragServices.rag_query(question=current_user_input, chat_id=chat_id, scope=rag_scope)
             rag_context = "\n".join(rag_chunks) if rag_chunks else "No relevant documents found."
         except Exception:
             rag_context = "Document retrieval service unavailable."
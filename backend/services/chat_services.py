@@ -1,29 +1,29 @@
-import sqlite3
-import os
 import json
 from utils.sql_to_json import rows_to_json
+from utils.fts_query import build_fts_query
+from services.database import Database, get_db_path
+
+#? bumped whenever a migration is added to _migrate, stored in PRAGMA user_version
+SCHEMA_VERSION = 2
+
+#? highlight markers and context size (in tokens) of the search snippets
+SNIPPET_OPEN = "<mark>"
+SNIPPET_CLOSE = "</mark>"
+SNIPPET_TOKENS = 16
 
 class ChatServices:
-    def __init__(self):
-        #? get the path to the dbs directory
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        db_folder = os.path.join(base_dir, "db")
-        
-        #? create folder if doesn't exist
-        os.makedirs(db_folder, exist_ok=True)
-        #? create the db file
-        db_path = os.path.join(db_folder, "chat_data.db")
-        #? create connection and initialize table
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
+    def __init__(self, db_path=None):
+        #? open the db file (WAL, one connection per request thread) and initialize the tables
+        self.db = Database(db_path or get_db_path("chat_data.db"))
         self._init_tables()
+        self._migrate()
         
 
 
     #* Initialize the table
     def _init_tables(self):
         #? create chats table if not already existing
-        self.cursor.execute("""
+        self.db.execute("""
         CREATE TABLE IF NOT EXISTS chats (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT DEFAULT 'New Chat',
@@ -33,7 +33,7 @@ class ChatServices:
         """)
 
         #? create the messages table if not already existing
-        self.cursor.execute("""
+        self.db.execute("""
         CREATE TABLE IF NOT EXISTS messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             chat_id INTEGER NOT NULL,
@@ -48,40 +48,89 @@ class ChatServices:
         """)
 
         #? commit the changes 
-        self.conn.commit()
+        self.db.commit()
+
+
+    #* bring older databases up to SCHEMA_VERSION
+    def _migrate(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        with self.db.transaction():
+            if version < 1:
+                #? secondary indexes: every chat/message lookup used to scan the whole table
+                self.db.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages(chat_id, created_at)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id, id)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS idx_messages_original ON messages(original_message_id, created_at)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS idx_messages_archived ON messages(is_archived, created_at)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS idx_chats_archived ON chats(is_archived, created_at)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS idx_chats_created ON chats(created_at)")
+
+            if version < 2:
+                #? external-content full-text index: stores only the token index, the text stays in messages
+                self.db.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    content,
+                    content='messages',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+                """)
+                #? triggers keep the index in sync (also fired by the ON DELETE CASCADE of chats)
+                self.db.execute("""
+                CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+                END
+                """)
+                self.db.execute("""
+                CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END
+                """)
+                self.db.execute("""
+                CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+                END
+                """)
+                #? index the messages that already exist
+                self.db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     
     
     #? ----- Chat Related Services ------
     #* Create a new chat entry
     def create_new_entry(self, title="New Chat"):
-        self.cursor.execute("INSERT INTO chats (title) VALUES (?)",(title,))
-        self.conn.commit()
-        new_chat_id = self.cursor.lastrowid
+        cursor = self.db.execute("INSERT INTO chats (title) VALUES (?)",(title,))
+        self.db.commit()
+        new_chat_id = cursor.lastrowid
         
         #* get the new chat
-        self.cursor.execute("SELECT * FROM chats WHERE id = ?", (new_chat_id,))
-        rows = self.cursor.fetchone()
+        cursor = self.db.execute("SELECT * FROM chats WHERE id = ?", (new_chat_id,))
+        rows = cursor.fetchone()
         
         if rows is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json([rows], labels)
         return json_data
     
     
     #* update a chat entry
     def update_chat_title(self, chat_id, new_title):
-        self.cursor.execute("UPDATE chats SET title = ? WHERE id = ?", (new_title, chat_id))
-        self.conn.commit()
+        self.db.execute("UPDATE chats SET title = ? WHERE id = ?", (new_title, chat_id))
+        self.db.commit()
         
     
     
     #* load chats list
     def load_chats_list(self):
-        self.cursor.execute("SELECT * FROM chats ORDER BY created_at")
-        rows = self.cursor.fetchall()
-        labels = [desc[0] for desc in self.cursor.description]
+        cursor = self.db.execute("SELECT * FROM chats ORDER BY created_at")
+        rows = cursor.fetchall()
+        labels = [desc[0] for desc in cursor.description]
         
         if rows is None:
             raise ValueError("Chat insertion failed: No row returned.")
@@ -104,44 +153,44 @@ class ChatServices:
     
     #* delete a chat entry from db (also remove messages related to the chat)
     def delete_chat_entry(self, chat_id):
-        self.cursor.execute("DELETE FROM chats WHERE id = ? ",(chat_id,))
-        self.conn.commit()
+        self.db.execute("DELETE FROM chats WHERE id = ? ",(chat_id,))
+        self.db.commit()
     
     
     #* toggle archive for a chat room
     def toggle_archive_chat(self, chat_id, current_state):
         state = 0 if current_state else 1
-        self.cursor.execute("""
+        self.db.execute("""
             UPDATE chats SET is_archived = ? WHERE id = ?
         """, (state,chat_id))
-        self.conn.commit()
+        self.db.commit()
         
     
     #* search for a chat
     def search_for_chat(self, query):
-        self.cursor.execute("""
+        cursor = self.db.execute("""
             SELECT * FROM chats
             WHERE LOWER(title) LIKE LOWER(?)
         """, (f"%{query}%",))
-        rows = self.cursor.fetchall()
+        rows = cursor.fetchall()
         
         if rows is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(rows, labels)
         return json_data
     
     
     #* load all archived chats
     def load_all_archived_chats(self):
-        self.cursor.execute("SELECT * FROM chats WHERE is_archived = 1 ORDER BY created_at")
-        rows = self.cursor.fetchall()
+        cursor = self.db.execute("SELECT * FROM chats WHERE is_archived = 1 ORDER BY created_at")
+        rows = cursor.fetchall()
         
         if rows is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(rows, labels)
         return json_data
     
@@ -149,16 +198,16 @@ class ChatServices:
     #* save a chat locally
     def save_chat_locally(self,chat_id:int):
         # fetch the metadata of the chat from db
-        self.cursor.execute("SELECT * FROM chats WHERE id = ?",(chat_id,))
-        chat_item = self.cursor.fetchone()
-        labels = [desc[0] for desc in self.cursor.description]
+        cursor = self.db.execute("SELECT * FROM chats WHERE id = ?",(chat_id,))
+        chat_item = cursor.fetchone()
+        labels = [desc[0] for desc in cursor.description]
         chat_metadata = rows_to_json([chat_item], labels)
         
         
         # get all messages for the chat
-        self.cursor.execute("SELECT * from messages WHERE chat_id = ?",(chat_id,))
-        messages_items = self.cursor.fetchall()
-        labels = [desc[0] for desc in self.cursor.description]
+        cursor = self.db.execute("SELECT * from messages WHERE chat_id = ?",(chat_id,))
+        messages_items = cursor.fetchall()
+        labels = [desc[0] for desc in cursor.description]
         messages_list = rows_to_json([messages_items], labels)
         
         # structure JSON
@@ -175,41 +224,41 @@ class ChatServices:
     #? --- Messages Related Services ----
     #* create a new message item 
     def create_new_message_entry(self, user_content: str, model_response: str, chat_id: int):
-        # Insert user message
-        self.cursor.execute(
-            "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
-            (chat_id, "user", user_content)
-        )
-        user_msg_id = self.cursor.lastrowid
-
-        # Insert assistant message
-        self.cursor.execute(
-            "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
-            (chat_id, "assistant", model_response)
-        )
-        assistant_msg_id = self.cursor.lastrowid
+        # Insert both messages in one transaction
+        with self.db.transaction():
+            # Insert user message
+            cursor = self.db.execute(
+                "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
+                (chat_id, "user", user_content)
+            )
+            user_msg_id = cursor.lastrowid
 
-        self.conn.commit()
+            # Insert assistant message
+            cursor = self.db.execute(
+                "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
+                (chat_id, "assistant", model_response)
+            )
+            assistant_msg_id = cursor.lastrowid
 
         # Fetch full message objects
-        self.cursor.execute("SELECT * FROM messages WHERE id = ?", (user_msg_id,))
-        user_msg = self.cursor.fetchone()
+        cursor = self.db.execute("SELECT * FROM messages WHERE id = ?", (user_msg_id,))
+        user_msg = cursor.fetchone()
         
         if user_msg is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json([user_msg], labels)
         user_json = json_data
 
-        self.cursor.execute("SELECT * FROM messages WHERE id = ?", (assistant_msg_id,))
-        assistant_msg = self.cursor.fetchone()
+        cursor = self.db.execute("SELECT * FROM messages WHERE id = ?", (assistant_msg_id,))
+        assistant_msg = cursor.fetchone()
         
         if assistant_msg is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
         # switch json
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json([assistant_msg], labels)
         assistant_json = json_data
         
@@ -224,7 +273,7 @@ class ChatServices:
     
     #* get context for edited messages
     def get_context_for_regeneration(self,chat_id: int, original_message_id: int):
-        self.cursor.execute("""
+        cursor = self.db.execute("""
             SELECT * FROM messages
             WHERE chat_id = ?
             AND id <= (
@@ -235,22 +284,22 @@ class ChatServices:
             ORDER BY id
             LIMIT 10;
         """, (chat_id, original_message_id))
-        return self.cursor.fetchall()
+        return cursor.fetchall()
     
     
     #* get all regenerate of a message
     def get_all_regenerate_for_message(self,message_id:int):
-        self.cursor("""
+        cursor = self.db.execute("""
                     SELECT * FROM messages
                     WHERE original_message_id = ?
                     ORDER BY created_at;
                     """,(message_id,))
-        rows = self.cursor.fetchall()
+        rows = cursor.fetchall()
         
         if rows is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(rows, labels)
         return json_data
     
@@ -261,21 +310,21 @@ class ChatServices:
     def regenerate_message(self, chat_id, new_content, new_reply, original_message_id, original_reply_id):
         # Insert regenerated assistant reply
         print(f"request for chat id with : {chat_id}")
-        self.cursor.execute(
+        cursor = self.db.execute(
             "INSERT INTO messages (chat_id, role, content, original_message_id) VALUES (?, ?, ?, ?)",
             (chat_id, 'assistant', new_reply, original_reply_id)
         )
-        assistant_msg_id = self.cursor.lastrowid
-        self.conn.commit()
+        assistant_msg_id = cursor.lastrowid
+        self.db.commit()
 
-        self.cursor.execute("SELECT * FROM messages WHERE id = ?", (assistant_msg_id,))
-        assistant_msg = self.cursor.fetchone()
+        cursor = self.db.execute("SELECT * FROM messages WHERE id = ?", (assistant_msg_id,))
+        assistant_msg = cursor.fetchone()
         
         if assistant_msg is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
         # switch json
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json([assistant_msg], labels)
         assistant_json = json_data
         
@@ -289,45 +338,52 @@ class ChatServices:
         
     #* load user chat content
     def load_all_chat_messages(self, chat_id):
-        self.cursor.execute("SELECT * FROM messages WHERE chat_id = ? ORDER BY created_at",(chat_id,))
-        rows = self.cursor.fetchall()
+        cursor = self.db.execute("SELECT * FROM messages WHERE chat_id = ? ORDER BY created_at",(chat_id,))
+        rows = cursor.fetchall()
         
         if rows is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(rows, labels)
         return json_data
     
     
     #* load last n message
     def load_n_chat_messages(self, chat_id, k=5):
-        self.cursor.execute(
+        cursor = self.db.execute(
             "SELECT * FROM messages WHERE chat_id = ? ORDER BY created_at DESC LIMIT ?",
             (chat_id, k)
         )
-        rows = self.cursor.fetchall()[::-1]
+        rows = cursor.fetchall()[::-1]
         
         if rows is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(rows, labels)
         return json_data
     
     
-    #* search for a message
-    def search_for_message(self, query):
-        self.cursor.execute("""
-            SELECT * FROM messages
-            WHERE LOWER(content) LIKE LOWER(?)
-        """, (f"%{query}%",))
-        rows = self.cursor.fetchall()
-        
-        if rows is None:
-            raise ValueError("Chat insertion failed: No row returned.")
-        
-        labels = [desc[0] for desc in self.cursor.description]
+    #* search for a message (bm25 ranked, the last word matches as a prefix while typing)
+    def search_for_message(self, query, limit=20, offset=0):
+        match = build_fts_query(query, prefix_last=True, operator="AND")
+        if match is None:
+            return []
+
+        cursor = self.db.execute("""
+            SELECT messages.*,
+                   snippet(messages_fts, 0, ?, ?, '...', ?) AS snippet,
+                   bm25(messages_fts) AS score
+            FROM messages_fts
+            JOIN messages ON messages.id = messages_fts.rowid
+            WHERE messages_fts MATCH ?
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+        """, (SNIPPET_OPEN, SNIPPET_CLOSE, SNIPPET_TOKENS, match, limit, offset))
+        rows = cursor.fetchall()
+        
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(rows, labels)
         return json_data
     
@@ -335,21 +391,21 @@ class ChatServices:
     #* archive a message
     def toggle_archive_message(self, message_id, current_state):
         state = 0 if current_state else 1
-        self.cursor.execute("""
+        self.db.execute("""
             UPDATE messages SET is_archived = ? WHERE id = ?
         """, (state,message_id))
-        self.conn.commit()
+        self.db.commit()
         
         
     #* load all archived messages
     def load_all_archived_messages(self):
-        self.cursor.execute("SELECT * FROM messages WHERE is_archived = 1 ORDER BY created_at")
-        rows = self.cursor.fetchall()
+        cursor = self.db.execute("SELECT * FROM messages WHERE is_archived = 1 ORDER BY created_at")
+        rows = cursor.fetchall()
         
         if rows is None:
             raise ValueError("Chat insertion failed: No row returned.")
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(rows, labels)
         return json_data
 
@@ -366,12 +422,17 @@ class ChatServices:
         WHERE {" OR ".join(like_clauses)}
         """
 
-        self.cursor.execute(query)
-        items = self.cursor.fetchall()
+        cursor = self.db.execute(query)
+        items = cursor.fetchall()
 
         if not items:
             raise ValueError("No matching media content found.")
 
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(items, labels)
         return json_data
+
+
+
+    def close(self):
+        self.db.close()
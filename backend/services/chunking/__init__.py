@@ -0,0 +1,47 @@
+from typing import Callable, Optional
+
+from .chunker import Chunker, approximate_tokens
+from .splitters import SPLITTERS, split_code, split_lines, split_markdown, split_sentences, split_table
+
+#? splitter (and header repetition) used for each uploaded file type, prose for anything else
+CHUNKING_BY_EXTENSION = {
+    "txt": {"splitter": "markdown"},
+    "md": {"splitter": "markdown"},
+    "json": {"splitter": "code"},
+    "docx": {"splitter": "sentences"},
+    "pdf": {"splitter": "sentences"},
+    "xlsx": {"splitter": "table", "repeat_header": True},
+    "csv": {"splitter": "table", "repeat_header": True},
+    "py": {"splitter": "code"},
+    "js": {"splitter": "code"},
+    "ts": {"splitter": "code"}
+}
+
+
+def get_chunker(
+    extension: str,
+    max_tokens: int = 200,
+    overlap_tokens: int = 30,
+    token_counter: Optional[Callable[[str], int]] = None
+) -> Chunker:
+    options = CHUNKING_BY_EXTENSION.get((extension or "").lower().lstrip("."), {"splitter": "sentences"})
+    return Chunker(
+        max_tokens=max_tokens,
+        overlap_tokens=overlap_tokens,
+        token_counter=token_counter,
+        **options
+    )
+
+
+__all__ = [
+    "Chunker",
+    "approximate_tokens",
+    "SPLITTERS",
+    "split_sentences",
+    "split_markdown",
+    "split_code",
+    "split_table",
+    "split_lines",
+    "CHUNKING_BY_EXTENSION",
+    "get_chunker"
+]
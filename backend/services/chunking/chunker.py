@@ -0,0 +1,178 @@
+import re
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+from .splitters import SAFE_BREAKS, SPLITTERS, Unit, fence_spans, split_lines
+
+_WORD_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def approximate_tokens(text: str) -> int:
+    #? words and punctuation marks, close to a word-piece count for latin text
+    return len(_WORD_PIECES.findall(text))
+
+
+#? streamed text is split in segments of about this many characters
+SEGMENT_CHARS = 1 << 16
+
+
+class Chunker:
+    """
+    Packs the units produced by a splitter into chunks of at most `max_tokens`
+    tokens, measured with `token_counter` (the embedding model tokenizer).
+    Consecutive chunks share up to `overlap_tokens` of whole trailing units, except
+    across section starts. With `repeat_header` the first unit of every section
+    (a table header row) opens each chunk of that section.
+    `iter_chunks` also takes an iterable of text pieces (pages, rows, blocks) and
+    only keeps about `SEGMENT_CHARS` of unsplit text at a time.
+    """
+
+    def __init__(
+        self,
+        splitter: str = "sentences",
+        max_tokens: int = 200,
+        overlap_tokens: int = 30,
+        token_counter: Optional[Callable[[str], int]] = None,
+        repeat_header: bool = False
+    ):
+        if splitter not in SPLITTERS:
+            raise ValueError(f"Unknown splitter: {splitter}")
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive")
+        self.splitter = splitter
+        self.max_tokens = max_tokens
+        self.overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+        self.count = token_counter or approximate_tokens
+        self.repeat_header = repeat_header
+
+
+    def chunk(self, text: Union[str, Iterable[str]]) -> List[str]:
+        return list(self.iter_chunks(text))
+
+
+    #* chunks in document order, produced lazily
+    def iter_chunks(self, text: Union[str, Iterable[str]]) -> Iterator[str]:
+        current = []          #? (text, tokens) of the chunk being filled
+        current_tokens = 0
+        fresh = 0             #? units not carried over from the previous chunk
+        header = None
+        first = True
+
+        for unit_text, starts_section, tokens in self._sized_units(self._units(text)):
+            if starts_section or first:
+                if fresh:
+                    yield self._join(current)
+                current, current_tokens, fresh, header = [], 0, 0, None
+                first = False
+                #? header rows bigger than half a chunk are not repeated
+                if self.repeat_header and tokens <= self.max_tokens // 2:
+                    header = (unit_text, tokens)
+                    current, current_tokens = [header], tokens
+                    continue
+
+            if current_tokens + tokens > self.max_tokens:
+                if fresh:
+                    yield self._join(current)
+                    current, current_tokens = self._overlap(current, header)
+                else:
+                    #? the carried overlap alone does not leave room, drop it
+                    current = [header] if header is not None else []
+                    current_tokens = header[1] if header is not None else 0
+                fresh = 0
+
+            current.append((unit_text, tokens))
+            current_tokens += tokens
+            fresh += 1
+
+        if fresh:
+            yield self._join(current)
+
+
+    #? splitter units of a whole text, or of a piece stream cut at safe breaks
+    def _units(self, text):
+        split = SPLITTERS[self.splitter]
+        if isinstance(text, str):
+            yield from split(text)
+            return
+
+        buffer = ""
+        new_section = False
+        for piece in text:
+            buffer += piece
+            if len(buffer) < SEGMENT_CHARS:
+                continue
+            end, at_break, reopen = self._cut(buffer)
+            if end is None:
+                continue
+            yield from self._segment_units(split(buffer[:end]), new_section)
+            #? a table cut at a blank line continues with a new table
+            new_section = at_break and self.splitter == "table"
+            buffer = reopen + buffer[end:]
+        yield from self._segment_units(split(buffer), new_section)
+
+
+    #? (end, cut at a safe break, text reopening what the cut left open), end is None to keep reading
+    def _cut(self, buffer):
+        fences = fence_spans(buffer) if self.splitter == "markdown" else []
+        breaks = list(SAFE_BREAKS[self.splitter].finditer(buffer))
+        for match in reversed(breaks):
+            #? a blank line inside a code fence is part of the code
+            if not any(start < match.end() <= stop for start, stop, _ in fences):
+                return match.end(), True, ""
+
+        #? no break at all: hold on a little longer, then fall back to a line or word boundary
+        if len(buffer) < 4 * SEGMENT_CHARS:
+            return None, False, ""
+        end = max(buffer.rfind("\n"), buffer.rfind(" ")) + 1 or len(buffer)
+        #? a fence too long to wait for is closed by the cut and opened again in the next segment
+        reopen = next((opening + "\n" for start, stop, opening in fences if start < end <= stop), "")
+        return end, False, reopen
+
+
+    @staticmethod
+    def _segment_units(units, new_section):
+        for index, (unit_text, starts_section) in enumerate(units):
+            yield unit_text, starts_section or (new_section and index == 0)
+
+
+    #? trailing units of the emitted chunk carried into the next one
+    def _overlap(self, units, header):
+        start = [header] if header is not None else []
+        tokens = header[1] if header is not None else 0
+        carried = []
+        budget = self.overlap_tokens
+        for unit in reversed(units[len(start):]):
+            if unit[1] > budget or len(carried) + 1 >= len(units) - len(start):
+                break
+            carried.insert(0, unit)
+            budget -= unit[1]
+        return start + carried, tokens + sum(unit[1] for unit in carried)
+
+
+    #? (text, starts_section, tokens), units over the budget are cut by lines then by words
+    def _sized_units(self, units: Iterable[Unit]):
+        for unit_text, starts_section in units:
+            tokens = self.count(unit_text.strip())
+            if tokens <= self.max_tokens:
+                yield unit_text, starts_section, tokens
+                continue
+
+            lines = split_lines(unit_text) if "\n" in unit_text.strip() else []
+            if len(lines) > 1:
+                for index, (line, _) in enumerate(lines):
+                    yield from self._sized_units([(line, starts_section and index == 0)])
+                continue
+
+            #? a single huge sentence: sliding word windows that overlap like chunks do
+            words = unit_text.split()
+            per_window = max(1, int(len(words) * self.max_tokens / tokens))
+            step = max(1, per_window - int(per_window * self.overlap_tokens / self.max_tokens))
+            for start in range(0, len(words), step):
+                window = " ".join(words[start:start + per_window]) + " "
+                yield window, starts_section and start == 0, self.count(window.strip())
+                if start + per_window >= len(words):
+                    break
+
+
+    @staticmethod
+    def _join(units) -> str:
+        return "".join(text for text, _ in units).strip()
@@ -0,0 +1,131 @@
+import re
+from typing import List, Tuple
+
+#? a unit is (text with its trailing separator, starts_section): units are packed into chunks,
+#? a unit starting a section (markdown heading, new table) never shares a chunk with what came before
+Unit = Tuple[str, bool]
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s+")
+_HEADING = re.compile(r"^#{1,6}\s+\S")
+_FENCE = re.compile(r"^(```|~~~)")
+
+
+def split_sentences(text: str) -> List[Unit]:
+    """Prose: paragraphs (blank lines) then sentences, single line breaks are layout only"""
+    units = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        sentences = [s for s in _SENTENCE_END.split(paragraph) if s]
+        for sentence in sentences[:-1]:
+            units.append((sentence + " ", False))
+        units.append((sentences[-1] + "\n\n", False))
+    return units
+
+
+def split_markdown(text: str) -> List[Unit]:
+    """Markdown: every heading opens a section, fenced code blocks stay whole, the rest is prose"""
+    units = []
+    paragraph = []
+    fence = None
+
+    def flush_paragraph():
+        if paragraph:
+            units.extend(split_sentences("\n".join(paragraph)))
+            paragraph.clear()
+
+    for line in text.splitlines():
+        if fence is not None:
+            fence.append(line)
+            if _FENCE.match(line.strip()):
+                units.append(("\n".join(fence) + "\n\n", False))
+                fence = None
+        elif _FENCE.match(line.strip()):
+            flush_paragraph()
+            fence = [line]
+        elif _HEADING.match(line):
+            flush_paragraph()
+            units.append((line.strip() + "\n", True))
+        elif not line.strip():
+            flush_paragraph()
+        else:
+            paragraph.append(line)
+
+    #? an unclosed fence still holds text
+    if fence is not None:
+        units.append(("\n".join(fence) + "\n\n", False))
+    flush_paragraph()
+    return units
+
+
+def fence_spans(text: str) -> List[Tuple[int, int, str]]:
+    """Markdown fenced code blocks as (start, end, opening line), an unclosed fence runs to the end"""
+    spans = []
+    opening = None
+    offset = 0
+    #? same line and fence rules as split_markdown
+    for line in text.splitlines(keepends=True):
+        if _FENCE.match(line.strip()):
+            if opening is None:
+                opening = (offset, line.rstrip("\r\n"))
+            else:
+                spans.append((opening[0], offset + len(line), opening[1]))
+                opening = None
+        offset += len(line)
+    if opening is not None:
+        spans.append((opening[0], len(text), opening[1]))
+    return spans
+
+
+def split_code(text: str) -> List[Unit]:
+    """Source and structured text (json): top-level blocks, a block ends before the next unindented line"""
+    units = []
+    block = []
+    for line in text.splitlines():
+        if block and line[:1] not in ("", " ", "\t", "}", ")", "]") and not block[-1].startswith("@"):
+            units.append(("\n".join(block) + "\n", False))
+            block = []
+        block.append(line)
+    if block:
+        units.append(("\n".join(block) + "\n", False))
+    return [unit for unit in units if unit[0].strip()]
+
+
+def split_table(text: str) -> List[Unit]:
+    """Tables (xlsx / tsv): one unit per row, a blank line starts a new table"""
+    units = []
+    new_table = False
+    for line in text.splitlines():
+        if not line.strip():
+            new_table = bool(units)
+            continue
+        units.append((line + "\n", new_table))
+        new_table = False
+    return units
+
+
+def split_lines(text: str) -> List[Unit]:
+    """Fallback for oversized units: one unit per line"""
+    return [(line + "\n", False) for line in text.splitlines() if line.strip()]
+
+
+#? where streamed text can be cut without changing what the splitter sees: paragraph breaks,
+#? or for code the start of a top-level line (markdown breaks inside a code fence are skipped)
+SAFE_BREAKS = {
+    "sentences": re.compile(r"\n\s*\n"),
+    "markdown": re.compile(r"\n\s*\n"),
+    "code": re.compile(r"\n(?=[^\s}\)\]@])"),
+    "table": re.compile(r"\n\s*\n"),
+    "lines": re.compile(r"\n")
+}
+
+
+SPLITTERS = {
+    "sentences": split_sentences,
+    "markdown": split_markdown,
+    "code": split_code,
+    "table": split_table,
+    "lines": split_lines
+}
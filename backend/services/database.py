@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+#? applied to every connection: WAL lets readers run next to the single writer,
+#? NORMAL only syncs at checkpoints (safe in WAL), pages and temp tables stay in memory
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -16000,         # KiB when negative: 16 MiB page cache per connection
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,         # ms a writer waits for another writer instead of failing
+    "foreign_keys": "ON"
+}
+
+
+def get_db_path(name: str) -> str:
+    #? the shared backend/db folder used by the chat and memory databases
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_folder = os.path.join(base_dir, "db")
+    os.makedirs(db_folder, exist_ok=True)
+    return os.path.join(db_folder, name)
+
+
+class Database:
+    """
+    One SQLite database file opened in WAL mode with one connection per thread.
+    Every call gets a fresh cursor on the calling thread's connection, so request
+    threads and background workers never share cursor state and readers are never
+    blocked by the writer. Writes go through `transaction()` or end with `commit()`.
+    """
+
+    def __init__(self, path: str, pragmas: Optional[dict] = None):
+        self.path = path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+        #? the journal mode is stored in the file, set once on the first connection
+        self.connection().execute("PRAGMA journal_mode = WAL")
+
+
+    #* the calling thread's connection, opened on first use
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        if self._closed:
+            raise sqlite3.ProgrammingError(f"Database {os.path.basename(self.path)} is closed")
+
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        self._local.conn = conn
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+
+    def execute(self, sql: str, params: Iterable = ()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, params)
+
+
+    def executemany(self, sql: str, rows: Iterable) -> sqlite3.Cursor:
+        return self.connection().executemany(sql, rows)
+
+
+    def commit(self):
+        self.connection().commit()
+
+
+    def rollback(self):
+        self.connection().rollback()
+
+
+    #* commit on success, roll back on error; nested blocks join the outer transaction
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+
+        #? IMMEDIATE takes the write lock up front, for read-then-write sequences
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.commit()
+                conn.close()
+            except sqlite3.ProgrammingError:
+                #? connections opened by worker threads that already went away
+                pass
+        self._local = threading.local()
@@ -0,0 +1,26 @@
+from .backends import (
+    EmbeddingBackend,
+    LlamaCppBackend,
+    OllamaBackend,
+    OnnxBackend,
+    SentenceTransformerBackend,
+    create_backend
+)
+from .cache import EmbeddingCache
+from .engine import EmbeddingEngine, get_embedding_engine
+from .settings import load_embedding_settings, save_embedding_settings, validate_embedding_settings
+
+__all__ = [
+    "EmbeddingBackend",
+    "SentenceTransformerBackend",
+    "OnnxBackend",
+    "OllamaBackend",
+    "LlamaCppBackend",
+    "create_backend",
+    "EmbeddingCache",
+    "EmbeddingEngine",
+    "get_embedding_engine",
+    "load_embedding_settings",
+    "save_embedding_settings",
+    "validate_embedding_settings"
+]
@@ -0,0 +1,253 @@
+import os
+import re
+from typing import List, Optional
+
+import numpy as np
+import requests
+
+# Import the optional embedding runtimes
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+try:
+    import onnxruntime as ort
+    from huggingface_hub import hf_hub_download
+    from tokenizers import Tokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+
+_WORD_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    #? unit length: every backend returns normalized vectors, the scoring assumes it
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype("float32")
+
+
+class EmbeddingBackend:
+    """Base class for the runtimes able to turn texts into vectors"""
+
+    name = "base"
+
+    def __init__(self):
+        self.model_name: str = ""
+        self.dimension: int = 0
+        #? longest input the model reads, anything after is truncated
+        self.max_tokens: int = 512
+
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        raise NotImplementedError
+
+
+    #* tokens the model sees for a text, remote backends approximate with words and punctuation
+    def count_tokens(self, text: str) -> int:
+        return len(_WORD_PIECES.findall(text))
+
+
+    def close(self):
+        pass
+
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Full precision PyTorch model through sentence-transformers"""
+
+    name = "sentence-transformers"
+
+    def __init__(self, model: str = "all-MiniLM-L6-v2"):
+        super().__init__()
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            raise ImportError("sentence-transformers is not installed")
+        self.model = SentenceTransformer(model)
+        self.model_name = model
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.max_tokens = self.model.max_seq_length or self.max_tokens
+
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype("float32")
+
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.model.tokenizer.tokenize(text))
+
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    Int8 quantized export of a sentence-transformers model run on ONNX Runtime.
+    The graph and tokenizer are pulled from the model repo on the hub (or read from
+    `model_dir`), then mean pooled and normalized like the PyTorch pipeline.
+    """
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        model: str = "sentence-transformers/all-MiniLM-L6-v2",
+        onnx_file: str = "onnx/model_quint8_avx2.onnx",
+        model_dir: Optional[str] = None,
+        max_length: int = 256,
+        threads: int = 0
+    ):
+        super().__init__()
+        if not ONNX_AVAILABLE:
+            raise ImportError("onnxruntime, tokenizers and huggingface_hub are required for the onnx backend")
+        if "/" not in model:
+            model = f"sentence-transformers/{model}"
+
+        if model_dir:
+            model_path = os.path.join(model_dir, os.path.basename(onnx_file))
+            tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+        else:
+            model_path = hf_hub_download(model, onnx_file)
+            tokenizer_path = hf_hub_download(model, "tokenizer.json")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        #? same vocabulary without truncation, for measuring chunk sizes
+        self.counting_tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.max_tokens = max_length
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+        self.model_name = f"{model.split('/')[-1]}-onnx-{os.path.splitext(os.path.basename(onnx_file))[0]}"
+        self.dimension = int(self.encode(["dimension probe"]).shape[1])
+
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype="int64")
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype="int64")
+
+            feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feed["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype="int64")
+
+            token_embeddings = self.session.run(None, feed)[0]
+
+            #? mean pooling over the real (non padding) tokens
+            mask = attention_mask[..., None].astype("float32")
+            summed = (token_embeddings * mask).sum(axis=1)
+            counts = np.clip(mask.sum(axis=1), 1e-9, None)
+            outputs.append(_normalize_rows(summed / counts))
+        return np.vstack(outputs)
+
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.counting_tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+
+class OllamaBackend(EmbeddingBackend):
+    """Embeddings from an already running Ollama server (/api/embed)"""
+
+    name = "ollama"
+
+    def __init__(self, model: str = "all-minilm", endpoint: str = "http://localhost:11434", timeout: int = 60):
+        super().__init__()
+        self.endpoint = endpoint.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.model_name = f"ollama:{model}"
+        self.dimension = int(self.encode(["dimension probe"]).shape[1])
+
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            response = requests.post(
+                f"{self.endpoint}/api/embed",
+                json={"model": self.model, "input": texts[start:start + batch_size]},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            outputs.append(np.array(response.json()["embeddings"], dtype="float32"))
+        return _normalize_rows(np.vstack(outputs))
+
+
+
+class LlamaCppBackend(EmbeddingBackend):
+    """Embeddings from a llama.cpp server started with --embedding (OpenAI style /v1/embeddings)"""
+
+    name = "llamacpp"
+
+    def __init__(self, model: str = "default", endpoint: str = "http://localhost:8080", timeout: int = 60):
+        super().__init__()
+        self.endpoint = endpoint.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.model_name = f"llamacpp:{model}"
+        self.dimension = int(self.encode(["dimension probe"]).shape[1])
+
+
+    def encode(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            response = requests.post(
+                f"{self.endpoint}/v1/embeddings",
+                json={"model": self.model, "input": texts[start:start + batch_size]},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+            outputs.append(np.array([item["embedding"] for item in data], dtype="float32"))
+        return _normalize_rows(np.vstack(outputs))
+
+
+
+BACKENDS = {
+    SentenceTransformerBackend.name: SentenceTransformerBackend,
+    OnnxBackend.name: OnnxBackend,
+    OllamaBackend.name: OllamaBackend,
+    LlamaCppBackend.name: LlamaCppBackend
+}
+
+
+def create_backend(settings: dict) -> EmbeddingBackend:
+    """
+    Build the backend described by the embedding settings
+    {
+        "backend": "sentence-transformers|onnx|ollama|llamacpp",
+        "model": "all-MiniLM-L6-v2",          # optional, backend default otherwise
+        "endpoint": "http://localhost:11434", # ollama / llamacpp only
+        "threads": 0                          # onnx only, 0 lets the runtime decide
+    }
+    """
+    name = settings.get("backend") or SentenceTransformerBackend.name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name}")
+
+    kwargs = {}
+    if settings.get("model"):
+        kwargs["model"] = settings["model"]
+    if name in (OllamaBackend.name, LlamaCppBackend.name) and settings.get("endpoint"):
+        kwargs["endpoint"] = settings["endpoint"]
+    if name == OnnxBackend.name:
+        if settings.get("threads"):
+            kwargs["threads"] = int(settings["threads"])
+        if settings.get("model_dir"):
+            kwargs["model_dir"] = settings["model_dir"]
+    return BACKENDS[name](**kwargs)
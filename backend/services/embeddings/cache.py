@@ -0,0 +1,148 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.vector_codec import decode_vector, encode_vector
+from services.database import Database, get_db_path
+
+
+def normalize_text(text: str) -> str:
+    #? same text with different spacing or unicode composition maps to one key
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_cache_key(model_name: str, text: str) -> str:
+    payload = f"{model_name}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed by model name + normalized text hash.
+    Lookups hit an in-memory LRU first and fall back to an SQLite table, so
+    vectors survive restarts and are shared by every embed call site. The lock
+    only guards the LRU, the SQLite tier goes through per-thread WAL connections.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_memory_items: int = 4096, max_disk_items: int = 500_000):
+        if db_path is None:
+            db_path = get_db_path("embedding_cache.db")
+
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._writes_since_trim = 0
+
+        self.db = Database(db_path)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                dim INTEGER,
+                vector BLOB
+            )
+        ''')
+        self.db.commit()
+
+
+    #* return {position: vector} for every text already cached
+    def get_many(self, model_name: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        keys = [make_cache_key(model_name, text) for text in texts]
+        found: Dict[int, np.ndarray] = {}
+        missing: Dict[str, List[int]] = {}
+
+        with self.lock:
+            for position, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[position] = vector
+                else:
+                    missing.setdefault(key, []).append(position)
+
+        #? second tier: one query for everything the LRU did not have, read without the lock
+        rows = []
+        key_list = list(missing.keys())
+        for start in range(0, len(key_list), 500):
+            part = key_list[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            rows += self.db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+            ).fetchall()
+
+        with self.lock:
+            for key, blob in rows:
+                vector = decode_vector(blob)
+                self._remember(key, vector)
+                for position in missing[key]:
+                    found[position] = vector
+
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+
+    #* store freshly computed vectors in both tiers
+    def put_many(self, model_name: str, texts: List[str], vectors: np.ndarray):
+        if len(texts) == 0:
+            return
+        rows = []
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                key = make_cache_key(model_name, text)
+                self._remember(key, vector)
+                rows.append((key, model_name, int(vector.shape[0]), encode_vector(vector)))
+            self._writes_since_trim += len(rows)
+            trim = self._writes_since_trim >= 1000
+            if trim:
+                self._writes_since_trim = 0
+
+        with self.db.transaction():
+            self.db.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)", rows
+            )
+        if trim:
+            self._trim_disk()
+
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+
+    #? drop the oldest rows once the disk tier grows past its budget
+    def _trim_disk(self):
+        count = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            self.db.execute('''
+                DELETE FROM embeddings WHERE rowid IN (
+                    SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?
+                )
+            ''', (overflow,))
+            self.db.commit()
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory)
+            }
+
+
+    def close(self):
+        self.db.close()
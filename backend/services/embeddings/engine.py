@@ -0,0 +1,113 @@
+import threading
+from typing import List, Optional, Union
+
+import numpy as np
+
+from utils.micro_batcher import MicroBatcher
+from .backends import EmbeddingBackend, create_backend
+from .cache import EmbeddingCache, normalize_text
+from .settings import load_embedding_settings
+
+
+class EmbeddingEngine:
+    """
+    Single embedding backend shared by every service.
+    Concurrent encode calls are queued and merged into micro-batches: the worker
+    waits at most `max_wait_ms` after the first request for more texts, up to
+    `max_batch_size`, then runs the backend once for the whole batch.
+    Texts found in the optional cache never reach the model.
+    """
+
+    def __init__(
+        self,
+        backend: EmbeddingBackend,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        cache: Optional[EmbeddingCache] = None
+    ):
+        self.backend = backend
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+
+        #? the model name keeps cached vectors of different backends apart
+        self.model_name = backend.model_name
+        self.dimension = backend.dimension
+        self.max_tokens = backend.max_tokens
+
+        self._closed = False
+        self._batcher = MicroBatcher(
+            self._encode_batch, max_batch_size, max_wait_ms,
+            name="embedding-engine", closed_message="Embedding engine is closed"
+        )
+
+
+    #* embed a list of texts, blocks until the batch holding them is done
+    def encode(self, texts: Union[str, List[str]]) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype="float32")
+        if self._closed:
+            raise RuntimeError("Embedding engine is closed")
+        if self.cache is None:
+            return self._submit(texts)
+
+        cached = self.cache.get_many(self.model_name, texts)
+        if len(cached) == len(texts):
+            return np.vstack([cached[i] for i in range(len(texts))])
+
+        #? embed every distinct missing text once, in the normalized form the key is built from
+        missing = {}
+        for position, text in enumerate(texts):
+            if position not in cached:
+                missing.setdefault(normalize_text(text), []).append(position)
+        missing_texts = list(missing.keys())
+        vectors = self._submit(missing_texts)
+        self.cache.put_many(self.model_name, missing_texts, vectors)
+
+        result = np.empty((len(texts), self.dimension), dtype="float32")
+        for position, vector in cached.items():
+            result[position] = vector
+        for text, vector in zip(missing_texts, vectors):
+            result[missing[text]] = vector
+        return result
+
+
+    #* token count of a text for the loaded model (used to size chunks)
+    def count_tokens(self, text: str) -> int:
+        return self.backend.count_tokens(text)
+
+
+    def _submit(self, texts: List[str]) -> np.ndarray:
+        return self._batcher.submit(texts)
+
+
+    #? runs on the batcher's worker thread with the texts of every merged request
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.backend.encode(texts, batch_size=self.max_batch_size).astype("float32")
+
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._batcher.close()
+        self.backend.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+
+#? ----- Shared instance ------
+_engine: Optional[EmbeddingEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_embedding_engine() -> EmbeddingEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine._closed:
+            backend = create_backend(load_embedding_settings())
+            _engine = EmbeddingEngine(backend, cache=EmbeddingCache())
+        return _engine
@@ -0,0 +1,117 @@
+import json
+import os
+
+from utils.vector_codec import VECTOR_DTYPES
+from .backends import BACKENDS, ONNX_AVAILABLE, SENTENCE_TRANSFORMERS_AVAILABLE
+
+DEFAULT_SETTINGS = {
+    "backend": "sentence-transformers",
+    "model": "",
+    "endpoint": "",
+    "model_dir": "",
+    "threads": 0,
+    "reranker": "",
+    #? how chunk and memory vectors are stored in SQLite, float16 halves the size
+    "vector_dtype": "float32"
+}
+
+#? settings only read by some backends, anything else has to stay empty for them
+BACKEND_OPTIONS = {
+    "sentence-transformers": ("model",),
+    "onnx": ("model", "model_dir", "threads"),
+    "ollama": ("model", "endpoint"),
+    "llamacpp": ("model", "endpoint")
+}
+
+#? local runtimes that must be importable for the backend to start
+BACKEND_RUNTIMES = {
+    "sentence-transformers": (SENTENCE_TRANSFORMERS_AVAILABLE, "sentence-transformers is not installed"),
+    "onnx": (ONNX_AVAILABLE, "onnxruntime, tokenizers and huggingface_hub are required for the onnx backend")
+}
+
+#? environment variables win over the saved file
+ENV_OVERRIDES = {
+    "backend": "EMBEDDING_BACKEND",
+    "model": "EMBEDDING_MODEL",
+    "endpoint": "EMBEDDING_ENDPOINT",
+    "reranker": "RERANKER_MODEL",
+    "vector_dtype": "EMBEDDING_VECTOR_DTYPE"
+}
+
+
+def get_settings_path() -> str:
+    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    db_folder = os.path.join(base_dir, "db")
+    os.makedirs(db_folder, exist_ok=True)
+    return os.path.join(db_folder, "embedding_settings.json")
+
+
+# load the embedding backend settings
+def load_embedding_settings() -> dict:
+    settings = dict(DEFAULT_SETTINGS)
+    if os.path.exists(get_settings_path()):
+        with open(get_settings_path(), "r") as f:
+            settings.update(json.load(f))
+
+    for key, env_name in ENV_OVERRIDES.items():
+        if os.environ.get(env_name):
+            settings[key] = os.environ[env_name]
+    return settings
+
+
+# check a complete settings dict against the backend it names
+def validate_embedding_settings(settings: dict):
+    backend = settings.get("backend")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    available, message = BACKEND_RUNTIMES.get(backend, (True, ""))
+    if not available:
+        raise ValueError(message)
+
+    for key in ("model", "endpoint", "model_dir", "threads"):
+        if settings.get(key) and key not in BACKEND_OPTIONS[backend]:
+            raise ValueError(f"'{key}' is not used by the {backend} backend")
+
+    #? remote model names are reported as "<backend>:<model>", never valid for another backend
+    model = str(settings.get("model") or "")
+    prefix = model.split(":", 1)[0] if ":" in model else None
+    if prefix in BACKENDS and prefix != backend:
+        raise ValueError(f"Model {model} belongs to the {prefix} backend, not {backend}")
+
+    endpoint = settings.get("endpoint")
+    if endpoint and not str(endpoint).startswith(("http://", "https://")):
+        raise ValueError(f"Invalid endpoint: {endpoint}")
+
+    if settings.get("vector_dtype") not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector storage type: {settings.get('vector_dtype')}")
+
+    try:
+        threads = int(settings.get("threads") or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid thread count: {settings.get('threads')}")
+    if threads < 0:
+        raise ValueError(f"Invalid thread count: {threads}")
+
+
+# save new embedding backend settings, used on the next start
+def save_embedding_settings(new_settings: dict) -> dict:
+    settings = dict(DEFAULT_SETTINGS)
+    if os.path.exists(get_settings_path()):
+        with open(get_settings_path(), "r") as f:
+            settings.update(json.load(f))
+
+    #? switching backend drops the old backend's model and options unless new ones are given
+    if new_settings.get("backend", settings["backend"]) != settings["backend"]:
+        for key in ("model", "endpoint", "model_dir", "threads"):
+            settings[key] = DEFAULT_SETTINGS[key]
+    for key in DEFAULT_SETTINGS:
+        if key in new_settings:
+            settings[key] = new_settings[key]
+
+    #? the payload's backend (or the stored one), never the default
+    validate_embedding_settings(settings)
+
+    with open(get_settings_path(), "w") as f:
+        json.dump(settings, f, indent=4)
+    return settings
@@ -0,0 +1,278 @@
+import codecs
+import json
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Iterator, List, Optional, Sequence, Tuple
+
+import docx
+import openpyxl
+import PyPDF2
+
+#? (text piece, units of the source done, units in the source): pages, paragraphs, rows or bytes
+Piece = Tuple[str, int, int]
+
+SUPPORTED_EXTENSIONS = ("txt", "json", "docx", "pdf", "xlsx")
+
+#? text files are decoded in blocks of this many bytes
+TEXT_BLOCK_SIZE = 1 << 20
+
+#? parsed on the process pool (pure python parsers), the other types stream in the caller
+POOL_EXTENSIONS = ("docx", "pdf")
+
+#? error reported when a pool worker died on a file
+_FAILURES = {
+    "docx": "Failed to read DOCX file",
+    "pdf": "Failed to extract PDF text"
+}
+
+
+class ExtractionError(ValueError):
+    """The file cannot be read as the type it claims to be"""
+
+
+def _source_size(fileobj: BinaryIO) -> int:
+    position = fileobj.tell()
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+    fileobj.seek(position)
+    return size
+
+
+def _iter_txt(fileobj: BinaryIO) -> Iterator[Piece]:
+    total = _source_size(fileobj)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    done = 0
+    while True:
+        block = fileobj.read(TEXT_BLOCK_SIZE)
+        done += len(block)
+        text = decoder.decode(block, final=not block)
+        if text:
+            yield text, done, total
+        if not block:
+            return
+
+
+def _iter_json(fileobj: BinaryIO) -> Iterator[Piece]:
+    #? a json document has to be parsed whole, the pretty-printed text is then handed out by lines
+    try:
+        parsed = json.load(fileobj)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ExtractionError("Invalid JSON file")
+    lines = json.dumps(parsed, indent=2).splitlines(keepends=True)
+    for start in range(0, len(lines), 1000):
+        yield "".join(lines[start:start + 1000]), min(start + 1000, len(lines)), len(lines)
+
+
+def _iter_docx(fileobj: BinaryIO) -> Iterator[Piece]:
+    try:
+        document = docx.Document(fileobj)
+    except Exception:
+        raise ExtractionError("Failed to read DOCX file")
+    paragraphs = document.paragraphs
+    for index, paragraph in enumerate(paragraphs):
+        yield ("\n" if index else "") + paragraph.text, index + 1, len(paragraphs)
+
+
+def _iter_pdf(fileobj: BinaryIO) -> Iterator[Piece]:
+    try:
+        reader = PyPDF2.PdfReader(fileobj)
+        total = len(reader.pages)
+    except Exception:
+        raise ExtractionError("Failed to extract PDF text")
+    for index in range(total):
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception:
+            raise ExtractionError("Failed to extract PDF text")
+        yield text, index + 1, total
+
+
+def _iter_xlsx(fileobj: BinaryIO) -> Iterator[Piece]:
+    try:
+        workbook = openpyxl.load_workbook(fileobj, read_only=True)
+    except Exception:
+        raise ExtractionError("Failed to read Excel file")
+    try:
+        total = sum(sheet.max_row or 0 for sheet in workbook.worksheets)
+        done = 0
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(values_only=True):
+                done += 1
+                yield "\t".join([str(cell) if cell is not None else "" for cell in row]) + "\n", done, max(total, done)
+    finally:
+        workbook.close()
+
+
+_EXTRACTORS = {
+    "txt": _iter_txt,
+    "json": _iter_json,
+    "docx": _iter_docx,
+    "pdf": _iter_pdf,
+    "xlsx": _iter_xlsx
+}
+
+
+def iter_document(extension: str, fileobj: BinaryIO) -> Iterator[Piece]:
+    """
+    Stream the text of an uploaded file piece by piece (pages, paragraphs, rows,
+    1 MiB text blocks) without loading the whole text. The pieces concatenate
+    to the same text the upload route used to build in one string.
+    """
+    extension = (extension or "").lower()
+    if extension not in _EXTRACTORS:
+        raise ExtractionError(f"Unsupported file type: {extension}")
+    return _EXTRACTORS[extension](fileobj)
+
+
+
+#? ----- process pool workers, module level so they pickle by name ------
+def _pdf_page_range(path: str, start: int, stop: int) -> List[str]:
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def _extract_path(extension: str, path: str) -> List[str]:
+    return [text for text, _, _ in _iter_file(extension, path)]
+
+
+def _iter_file(extension: str, path: str) -> Iterator[Piece]:
+    with open(path, "rb") as f:
+        yield from iter_document(extension, f)
+
+
+class ExtractionService:
+    """
+    Text extraction on a process pool, PyPDF2 and python-docx being pure python and
+    CPU bound. Uploads are read from their spooled path: large PDFs as page ranges
+    spread over the workers and returned in page order, DOCX files and smaller PDFs
+    as one task each. `extract_files` starts several files side by side so the next
+    uploads are parsed while the current one is chunked and embedded. Text, JSON
+    and Excel files stream in the calling thread where the pool would only add
+    overhead, as does everything with a single worker.
+    """
+
+    def __init__(self, workers: Optional[int] = None, pages_per_task: int = 16, min_parallel_pages: int = 32):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.pages_per_task = max(1, pages_per_task)
+        self.min_parallel_pages = min_parallel_pages
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+
+    #? the pool starts on first use, with spawn so workers do not inherit the server threads
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+
+    #? ("inline" | "whole" | "pages", page count) for a file on disk
+    def _plan(self, extension: str, path: str) -> Tuple[str, int]:
+        if self.workers < 2 or extension not in POOL_EXTENSIONS:
+            return "inline", 0
+        if extension == "pdf":
+            try:
+                total = len(PyPDF2.PdfReader(path).pages)
+            except Exception:
+                raise ExtractionError("Failed to extract PDF text")
+            if total >= self.min_parallel_pages:
+                return "pages", total
+        return "whole", 0
+
+
+    #* same pieces as `iter_document` for a file on disk, `future` comes from `extract_files`
+    def iter_path(self, extension: str, path: str, future: Optional[Future] = None) -> Iterator[Piece]:
+        extension = (extension or "").lower()
+        if future is not None:
+            return self._iter_future(future, extension)
+        mode, total = self._plan(extension, path)
+        if mode == "pages":
+            return self._iter_pdf_parallel(path, total)
+        if mode == "whole":
+            return self._iter_future(self._executor().submit(_extract_path, extension, path), extension)
+        return _iter_file(extension, path)
+
+
+    #* start whole-file extraction of several files side by side, None for files read in the caller
+    def extract_files(self, files: Sequence[Tuple[str, str]]) -> List[Optional[Future]]:
+        futures = []
+        for extension, path in files:
+            extension = (extension or "").lower()
+            try:
+                mode, _ = self._plan(extension, path)
+            except ExtractionError:
+                #? reported when the file itself is read
+                mode = "inline"
+            futures.append(self._executor().submit(_extract_path, extension, path) if mode == "whole" else None)
+        return futures
+
+
+    def _iter_future(self, future: Future, extension: str) -> Iterator[Piece]:
+        try:
+            texts = future.result()
+        except BrokenProcessPool:
+            self._discard()
+            raise ExtractionError(_FAILURES.get(extension, "Failed to extract text"))
+        except ExtractionError:
+            raise
+        except Exception:
+            raise ExtractionError(_FAILURES.get(extension, "Failed to extract text"))
+        for index, text in enumerate(texts):
+            yield text, index + 1, len(texts)
+
+
+    def _iter_pdf_parallel(self, path: str, total: int) -> Iterator[Piece]:
+        pool = self._executor()
+        ranges = deque(
+            (start, min(start + self.pages_per_task, total))
+            for start in range(0, total, self.pages_per_task)
+        )
+        pending = deque()
+        try:
+            done = 0
+            while ranges or pending:
+                #? a bounded window of ranges in flight keeps memory flat on huge files
+                while ranges and len(pending) < 2 * self.workers:
+                    start, stop = ranges.popleft()
+                    pending.append(pool.submit(_pdf_page_range, path, start, stop))
+                try:
+                    pages = pending.popleft().result()
+                except BrokenProcessPool:
+                    self._discard(pool)
+                    raise ExtractionError("Failed to extract PDF text")
+                except Exception:
+                    raise ExtractionError("Failed to extract PDF text")
+                for text in pages:
+                    done += 1
+                    yield text, done, total
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+    #? a crashed worker breaks the whole pool, the next call starts a new one
+    #? (without `pool`: the current pool, only if it is the broken one)
+    def _discard(self, pool: Optional[ProcessPoolExecutor] = None):
+        with self._pool_lock:
+            if pool is None:
+                pool = self._pool if self._pool is not None and getattr(self._pool, "_broken", False) else None
+            if pool is None:
+                return
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,308 @@
+import os
+import queue
+import shutil
+import threading
+import uuid
+
+from utils.sql_to_json import rows_to_json
+from utils.synchronized import synchronized
+from services.database import Database
+from services.extraction import SUPPORTED_EXTENSIONS, ExtractionError, ExtractionService
+from services.library_services import RAGServices
+
+#? queued -> running -> done / duplicate / failed / cancelled, running jobs go back to queued on restart
+JOB_STATES = ("queued", "running", "done", "duplicate", "failed", "cancelled")
+FINISHED_STATES = ("done", "duplicate", "failed", "cancelled")
+
+JOB_LABELS = [
+    "id", "status", "filename", "extension", "title", "chat_id", "is_isolated", "tags",
+    "chunks_done", "chunks_total", "source_done", "source_total", "file_id", "error",
+    "created_at", "updated_at"
+]
+
+
+class JobCancelled(Exception):
+    """Raised from the progress callback to stop a running ingest"""
+
+
+class IngestionJobs:
+    """
+    Persistent queue of RAG uploads. The upload is copied to disk and recorded in
+    jobs.db, worker threads run the streaming ingest and write progress back, so
+    the request returns at once and a restart picks up unfinished jobs.
+    """
+
+    def __init__(self, rag: RAGServices, extraction: ExtractionService, workers: int = 1):
+        #? get path for the db and the spooled uploads
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        db_folder = os.path.join(base_dir, "db")
+        self.upload_dir = os.path.join(db_folder, "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.db_path = os.path.join(db_folder, "jobs.db")
+
+        self.rag = rag
+        self.extraction = extraction
+        self.workers = max(1, workers)
+
+        #? WAL database with a connection per thread (request threads and workers)
+        self.lock = threading.RLock()
+        self.db = Database(self.db_path)
+        self._init_tables()
+
+        self._queue = queue.Queue()
+        #? cancel flags of the running jobs
+        self._cancel = {}
+        #? pool extractions of queued uploads started ahead of their turn (job id -> future)
+        self._prefetched = {}
+        self._threads = []
+        self._closing = threading.Event()
+
+
+    #* start the init table
+    def _init_tables(self):
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'queued',
+                filename TEXT,
+                extension TEXT,
+                title TEXT,
+                chat_id TEXT,
+                is_isolated INTEGER DEFAULT 0,
+                tags TEXT,
+                chunks_done INTEGER DEFAULT 0,
+                chunks_total INTEGER,
+                source_done INTEGER DEFAULT 0,
+                source_total INTEGER,
+                file_id INTEGER,
+                error TEXT,
+                upload_path TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        self.db.commit()
+
+
+    #* requeue what a previous run left unfinished and start the workers
+    def start(self):
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE jobs SET status = 'queued', chunks_done = 0, source_done = 0 WHERE status = 'running'"
+            )
+            self.db.commit()
+            cursor = self.db.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at, rowid")
+            for (job_id,) in cursor.fetchall():
+                self._queue.put(job_id)
+
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingestion-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    #* spool an upload to disk and queue it, returns the job
+    def submit(self, fileobj, filename, extension, title="", is_isolated=False, chat_id="", tags=""):
+        extension = (extension or "").lower()
+        if extension not in SUPPORTED_EXTENSIONS:
+            raise ExtractionError(f"Unsupported file type: {extension}")
+
+        job_id = uuid.uuid4().hex
+        upload_path = os.path.join(self.upload_dir, f"{job_id}.{extension}")
+        with open(upload_path, "wb") as f:
+            shutil.copyfileobj(fileobj, f)
+
+        with self.lock:
+            self.db.execute('''
+                INSERT INTO jobs (id, filename, extension, title, chat_id, is_isolated, tags, upload_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, filename, extension, title, chat_id, 1 if is_isolated else 0, tags, upload_path))
+            self.db.commit()
+        self._queue.put(job_id)
+        return self.get_job(job_id)
+
+
+    @synchronized
+    def get_job(self, job_id):
+        cursor = self.db.execute(f"SELECT {', '.join(JOB_LABELS)} FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        return self._to_json(row) if row else None
+
+
+    @synchronized
+    def list_jobs(self, status=None, limit=100):
+        if status:
+            cursor = self.db.execute(
+                f"SELECT {', '.join(JOB_LABELS)} FROM jobs WHERE status = ? ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                (status, limit)
+            )
+        else:
+            cursor = self.db.execute(
+                f"SELECT {', '.join(JOB_LABELS)} FROM jobs ORDER BY created_at DESC, rowid DESC LIMIT ?",
+                (limit,)
+            )
+        return [self._to_json(row) for row in cursor.fetchall()]
+
+
+    #* cancel a queued job at once, a running one after its current batch
+    @synchronized
+    def cancel(self, job_id):
+        cursor = self.db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None or row[0] in FINISHED_STATES:
+            return False
+        if row[0] == "running":
+            self._cancel[job_id].set()
+        else:
+            future = self._prefetched.pop(job_id, None)
+            if future is not None:
+                future.cancel()
+            self._finish(job_id, "cancelled")
+        return True
+
+
+    @staticmethod
+    def _to_json(row):
+        job = rows_to_json([row], JOB_LABELS)[0]
+        job["is_isolated"] = bool(job["is_isolated"])
+        #? while running the chunk total is estimated from how much of the source was read
+        if job["status"] == "running" and job["source_done"] and job["source_total"]:
+            job["chunks_total"] = max(
+                job["chunks_done"], round(job["chunks_done"] * job["source_total"] / job["source_done"])
+            )
+        job["progress"] = job["chunks_done"] / job["chunks_total"] if job["chunks_total"] else 0.0
+        if job["status"] == "done":
+            job["progress"] = 1.0
+        return job
+
+
+    def _update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.db.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (*fields.values(), job_id)
+            )
+            self.db.commit()
+
+
+    #? terminal state, the spooled upload is no longer needed
+    def _finish(self, job_id, status, **fields):
+        self._update(job_id, status=status, **fields)
+        with self.lock:
+            cursor = self.db.execute("SELECT upload_path FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        if row and row[0] and os.path.exists(row[0]):
+            os.remove(row[0])
+
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None or self._closing.is_set():
+                return
+            try:
+                self._run(job_id)
+            except Exception as e:
+                print(f"Error running ingestion job {job_id}: {e}")
+
+
+    #? extraction of the next queued uploads starts on the pool while the current one is indexed
+    def _prefetch(self):
+        with self.lock:
+            cursor = self.db.execute(
+                "SELECT id, extension, upload_path FROM jobs WHERE status = 'queued' ORDER BY created_at, rowid LIMIT ?",
+                (self.extraction.workers,)
+            )
+            ahead = [row for row in cursor.fetchall() if row[0] not in self._prefetched]
+            #? claimed before submitting, outside the lock (the pool may be starting)
+            for job_id, _, _ in ahead:
+                self._prefetched[job_id] = None
+        if not ahead:
+            return
+
+        futures = self.extraction.extract_files([(extension, path) for _, extension, path in ahead])
+        with self.lock:
+            for (job_id, _, _), future in zip(ahead, futures):
+                if job_id in self._prefetched and future is not None:
+                    self._prefetched[job_id] = future
+                elif future is not None:
+                    #? cancelled or started meanwhile
+                    future.cancel()
+                elif self._prefetched.get(job_id, 0) is None:
+                    self._prefetched.pop(job_id)
+
+
+    def _run(self, job_id):
+        with self.lock:
+            cursor = self.db.execute(
+                "SELECT status, filename, extension, title, chat_id, is_isolated, tags, upload_path FROM jobs WHERE id = ?",
+                (job_id,)
+            )
+            row = cursor.fetchone()
+            future = self._prefetched.pop(job_id, None)
+            #? cancelled (or already handled) while it waited in the queue
+            if row is None or row[0] != "queued":
+                if future is not None:
+                    future.cancel()
+                return
+            cancel = self._cancel[job_id] = threading.Event()
+            self._update(job_id, status="running")
+        _, filename, extension, title, chat_id, is_isolated, tags, upload_path = row
+
+        def progress(chunks_done, source_done, source_total):
+            self._update(job_id, chunks_done=chunks_done, source_done=source_done, source_total=source_total)
+            if cancel.is_set():
+                raise JobCancelled()
+
+        try:
+            self._prefetch()
+            file_id = self.rag.ingest(
+                self.extraction.iter_path(extension, upload_path, future),
+                filename=filename,
+                extension=extension,
+                title=title,
+                is_isolated=bool(is_isolated),
+                chat_id=chat_id,
+                tags=tags,
+                progress=progress
+            )
+        except JobCancelled:
+            #? stopped by shutdown rather than by the user: left running, requeued on the next start
+            if not self._closing.is_set():
+                self._finish(job_id, "cancelled")
+        except ExtractionError as e:
+            self._finish(job_id, "failed", error=str(e))
+        except Exception as e:
+            print(f"Error ingesting {filename}: {e}")
+            self._finish(job_id, "failed", error="Failed to index file")
+        else:
+            if file_id is None:
+                self._finish(job_id, "duplicate")
+            else:
+                with self.lock:
+                    cursor = self.db.execute("SELECT chunks_done FROM jobs WHERE id = ?", (job_id,))
+                    chunks_done = cursor.fetchone()[0]
+                self._finish(job_id, "done", file_id=file_id, chunks_total=chunks_done)
+        finally:
+            with self.lock:
+                self._cancel.pop(job_id, None)
+
+
+    #* stop the workers after their current batch, unfinished jobs resume on the next start
+    def close(self):
+        self._closing.set()
+        with self.lock:
+            for cancel in self._cancel.values():
+                cancel.set()
+            for future in self._prefetched.values():
+                if future is not None:
+                    future.cancel()
+            self._prefetched.clear()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=30)
+        self._threads = []
+        self.db.close()
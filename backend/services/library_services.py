@@ -1,8 +1,48 @@
-import os, sqlite3, numpy as np, faiss, pickle, hashlib
-from sentence_transformers import SentenceTransformer
+import os, hashlib, json, threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.fts_query import build_fts_query
+from utils.synchronized import synchronized
+from utils.vector_codec import encode_vector, load_matrix, migrate_vector_table
+from services.chunking import get_chunker
+from services.database import Database
+from services.embeddings import EmbeddingEngine, get_embedding_engine
+from services.embeddings.cache import normalize_text
+from services.reranker import Reranker
+from services.vector_index import IdFilter, VectorIndex
+
+# Retrieval scopes: global + current chat documents, isolated documents only, or everything
+RAG_SCOPES = ("chat", "isolated", "all")
+# Retrieval modes: embeddings only, FTS5 bm25 only, or both fused with reciprocal rank fusion
+RAG_SEARCH_MODES = ("vector", "keyword", "hybrid")
+# Chunks re-embedded per encode call when the embedding model changes
+REEMBED_BATCH_SIZE = 256
+# Scope cache marker, None is a cached "no filter"
+_UNCACHED = object()
+
 
 class RAGServices:
-    def __init__(self, db_name="rag.db", faiss_index_path="rag.index"):
+    def __init__(
+        self,
+        db_name="rag.db",
+        faiss_index_path="rag.index",
+        embedder: EmbeddingEngine = None,
+        vector_dtype="float32",
+        search_mode="hybrid",
+        rrf_k=60,
+        vector_weight=1.0,
+        keyword_weight=1.0,
+        candidate_factor=4,
+        ann_kind="hnsw",
+        ann_threshold=100_000,
+        chunk_tokens=200,
+        chunk_overlap=30,
+        reranker: Reranker = None,
+        rerank_candidates=20,
+        query_cache_size=256
+    ):
         base_dir = os.path.dirname(os.path.abspath(__file__))
         db_folder = os.path.join(base_dir, "db")
         os.makedirs(db_folder, exist_ok=True)
@@ -10,17 +50,52 @@ class RAGServices:
         self.db_path = os.path.join(db_folder, db_name)
         self.faiss_index_path = os.path.join(db_folder, faiss_index_path)
 
-        self.embedding_dim = 384
-        self.embedder = SentenceTransformer("all-MiniLM-L6-v2")
-
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+        self.embedder = embedder or get_embedding_engine()
+        self.embedding_dim = self.embedder.dimension
+        self.vector_dtype = vector_dtype
+
+        # Hybrid retrieval: each leg returns k * candidate_factor hits, fused as sum(weight / (rrf_k + rank))
+        if search_mode not in RAG_SEARCH_MODES:
+            raise ValueError(f"Unknown RAG search mode: {search_mode}")
+        self.search_mode = search_mode
+        self.rrf_k = rrf_k
+        self.vector_weight = vector_weight
+        self.keyword_weight = keyword_weight
+        self.candidate_factor = candidate_factor
+        # Exact search until `ann_threshold` chunks, then an HNSW / IVF-PQ index built in the background
+        self.ann_kind = ann_kind
+        self.ann_threshold = ann_threshold
+        # Chunk size in model tokens (never above what the embedder reads) and tokens shared by neighbours
+        self.chunk_tokens = min(chunk_tokens, self.embedder.max_tokens - 2)
+        self.chunk_overlap = chunk_overlap
+        # Optional cross-encoder stage over the first `rerank_candidates` hits
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+
+        self.lock = threading.RLock()
+        # Allowed chunk ids per (scope, chat_id), cleared whenever chunks are added or removed
+        self._scope_cache = {}
+        # Final rag_query results, LRU keyed by the index version and the normalized request:
+        # every ingest batch and delete bumps the version, so stale entries are never served
+        self.index_version = 0
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        # WAL database with a connection per thread, the lock keeps rows, FAISS and caches in step
+        self.db = Database(self.db_path)
         self._init_tables()
-        self._load_faiss_index()
+        merged = self._migrate_shared_chunks()
+        migrate_vector_table(self.db.connection(), "chunks", self.vector_dtype)
+        self._migrate_content_index()
+        reembedded = self._sync_embedding_model()
+        self._load_faiss_index(force_rebuild=reembedded or merged)
+        self._discard_unfinished()
+        self.cleanup_orphans()
 
 
     def _init_tables(self):
-        self.cursor.execute('''
+        self.db.execute('''
             CREATE TABLE IF NOT EXISTS files (
                 id INTEGER PRIMARY KEY,
                 filename TEXT,
@@ -31,153 +106,666 @@ class RAGServices:
                 tags TEXT
             )
         ''')
-        self.cursor.execute('''
+        # A chunk is stored (and embedded) once per distinct text, files list theirs in file_chunks
+        self.db.execute('''
             CREATE TABLE IF NOT EXISTS chunks (
                 id INTEGER PRIMARY KEY,
-                file_id INTEGER,
                 content TEXT,
                 embedding BLOB,
-                FOREIGN KEY(file_id) REFERENCES files(id) ON DELETE CASCADE
+                hash TEXT
             )
         ''')
-        self.cursor.execute('''
-            CREATE VIRTUAL TABLE IF NOT EXISTS content_index USING fts5(content, file_id UNINDEXED)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS file_chunks (
+                file_id INTEGER NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY(file_id, position),
+                FOREIGN KEY(file_id) REFERENCES files(id) ON DELETE CASCADE,
+                FOREIGN KEY(chunk_id) REFERENCES chunks(id)
+            )
         ''')
-        self.conn.commit()
-
+        cursor = self.db.execute("PRAGMA table_info(files)")
+        if "is_isolated" not in [row[1] for row in cursor.fetchall()]:
+            self.db.execute("ALTER TABLE files ADD COLUMN is_isolated INTEGER DEFAULT 0")
+        # Uploads without a chat were stored as '' or the string 'None', both mean a global file
+        self.db.execute("UPDATE files SET chat_id = NULL WHERE chat_id IN ('', 'None')")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_file_chunks_chunk_id ON file_chunks(chunk_id)")
+        self.db.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS content_index USING fts5(content)
+        ''')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS vector_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        self.db.commit()
 
-    def _load_faiss_index(self):
-        meta_path = self.faiss_index_path + ".meta"
-        if os.path.exists(self.faiss_index_path) and os.path.exists(meta_path):
-            self.index = faiss.read_index(self.faiss_index_path)
-            with open(self.faiss_index_path + ".meta", "rb") as f:
-                self.chunk_texts = pickle.load(f)
-        else:
-            self.index = faiss.IndexFlatL2(self.embedding_dim)
-            self.chunk_texts = []
 
+    def _migrate_content_index(self):
+        # FTS rows used to get their own rowids; key them by chunks.id so keyword hits fuse with vector hits
+        cursor = self.db.execute("SELECT value FROM vector_meta WHERE key = 'content_index.rowid'")
+        row = cursor.fetchone()
+        if row and row[0] == "chunk_id":
+            return
 
-    def _save_faiss_index(self):
-        faiss.write_index(self.index, self.faiss_index_path)
-        with open(self.faiss_index_path + ".meta", "wb") as f:
-            pickle.dump(self.chunk_texts, f)
+        with self.db.transaction():
+            self.db.execute("DELETE FROM content_index")
+            self.db.execute('''
+                INSERT INTO content_index (rowid, content)
+                SELECT id, content FROM chunks
+            ''')
+            self.db.execute(
+                "INSERT OR REPLACE INTO vector_meta (key, value) VALUES ('content_index.rowid', 'chunk_id')"
+            )
 
 
-    def _compute_hash(self, content: str) -> str:
+    def _migrate_shared_chunks(self):
+        # Chunks used to belong to one file each (chunks.file_id): move ownership to file_chunks,
+        # hash every chunk and merge identical ones. Returns True when vectors were merged away
+        cursor = self.db.execute("PRAGMA table_info(chunks)")
+        if "file_id" not in [row[1] for row in cursor.fetchall()]:
+            self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_chunks_hash ON chunks(hash)")
+            self.db.commit()
+            return False
+
+        cursor = self.db.execute("SELECT id, file_id, content FROM chunks ORDER BY file_id, id")
+        kept = {}
+        hashes = []
+        mapping = []
+        merged = []
+        positions = {}
+        for chunk_id, file_id, content in cursor.fetchall():
+            chunk_hash = self._chunk_hash(content)
+            if chunk_hash in kept:
+                merged.append((chunk_id,))
+            else:
+                kept[chunk_hash] = chunk_id
+                hashes.append((chunk_hash, chunk_id))
+            position = positions[file_id] = positions.get(file_id, -1) + 1
+            mapping.append((file_id, kept[chunk_hash], position))
+
+        # Table rebuild to drop the cascading file_id column, foreign keys stay off meanwhile
+        self.db.execute("PRAGMA foreign_keys = OFF")
+        try:
+            with self.db.transaction():
+                self.db.execute('''
+                    CREATE TABLE chunks_shared (
+                        id INTEGER PRIMARY KEY,
+                        content TEXT,
+                        embedding BLOB,
+                        hash TEXT
+                    )
+                ''')
+                self.db.execute("INSERT INTO chunks_shared (id, content, embedding) SELECT id, content, embedding FROM chunks")
+                self.db.executemany("DELETE FROM chunks_shared WHERE id = ?", merged)
+                self.db.executemany("UPDATE chunks_shared SET hash = ? WHERE id = ?", hashes)
+                self.db.execute("DROP TABLE chunks")
+                self.db.execute("ALTER TABLE chunks_shared RENAME TO chunks")
+                self.db.execute("CREATE UNIQUE INDEX idx_chunks_hash ON chunks(hash)")
+                self.db.execute("DELETE FROM file_chunks")
+                self.db.executemany(
+                    "INSERT INTO file_chunks (file_id, chunk_id, position) VALUES (?, ?, ?)", mapping
+                )
+                # The full-text index loses its file_id column too
+                self.db.execute("DROP TABLE content_index")
+                self.db.execute("CREATE VIRTUAL TABLE content_index USING fts5(content)")
+                self.db.execute("INSERT INTO content_index (rowid, content) SELECT id, content FROM chunks")
+                self.db.execute(
+                    "INSERT OR REPLACE INTO vector_meta (key, value) VALUES ('content_index.rowid', 'chunk_id')"
+                )
+        finally:
+            self.db.execute("PRAGMA foreign_keys = ON")
+
+        if merged:
+            print(f"Merged {len(merged)} duplicate chunks")
+        return bool(merged)
+
+
+    def _load_faiss_index(self, force_rebuild=False):
+        # FAISS ids are chunks.id, so a hit resolves with a primary key lookup
+        self.index = VectorIndex(
+            self.faiss_index_path,
+            self.embedding_dim,
+            ann_kind=self.ann_kind,
+            ann_threshold=self.ann_threshold,
+            vector_source=self._stored_vectors,
+            mmap=True
+        )
+        # Chunk text comes from the chunks table, the old pickled copy of every chunk is no longer used
+        meta_path = self.faiss_index_path + ".meta"
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        # Older positional indexes (or any index out of step with the table) are rebuilt from the stored vectors
+        cursor = self.db.execute("SELECT COUNT(*) FROM chunks")
+        if force_rebuild or self.index.ntotal != cursor.fetchone()[0]:
+            self._rebuild_faiss_index()
+
+
+    def _stored_vectors(self, ids=None):
+        # Every chunk vector, read by the index when it trains or rebuilds in the background;
+        # `ids` picks single rows for an exact filtered search, which runs while a writer may hold the lock
+        if ids is not None:
+            return load_matrix(
+                self.db.connection(), "chunks", self.embedding_dim, self.vector_dtype,
+                where="WHERE id IN (SELECT value FROM json_each(?))", params=(json.dumps(ids.tolist()),)
+            )
+        with self.lock:
+            return load_matrix(self.db.connection(), "chunks", self.embedding_dim, self.vector_dtype)
+
+
+    def _rebuild_faiss_index(self):
+        ids, vectors = self._stored_vectors()
+        self.index.rebuild(ids, vectors)
+        self.index.save()
+
+
+    def _sync_embedding_model(self):
+        # Vectors from another backend live in another space: re-embed every chunk
+        cursor = self.db.execute("SELECT value FROM vector_meta WHERE key = 'model'")
+        row = cursor.fetchone()
+        stored_model = row[0] if row else "all-MiniLM-L6-v2"
+
+        reembedded = False
+        if stored_model != self.embedder.model_name:
+            total = self.db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            if total:
+                print(f"Re-embedding {total} chunks for {self.embedder.model_name}")
+            # One batch in memory at a time, committed as it goes so the WAL stays small
+            last_id = -1
+            while True:
+                cursor = self.db.execute(
+                    "SELECT id, content FROM chunks WHERE id > ? ORDER BY id LIMIT ?", (last_id, REEMBED_BATCH_SIZE)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                embeddings = self.embedder.encode([content for _, content in rows]).astype("float32")
+                self.db.executemany(
+                    "UPDATE chunks SET embedding = ? WHERE id = ?",
+                    [(encode_vector(emb, self.vector_dtype), chunk_id) for (chunk_id, _), emb in zip(rows, embeddings)]
+                )
+                self.db.commit()
+                last_id = rows[-1][0]
+                reembedded = True
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO vector_meta (key, value) VALUES ('model', ?)", (self.embedder.model_name,)
+        )
+        self.db.commit()
+        return reembedded
+
+
+    @staticmethod
+    def _chunk_hash(content):
         return hashlib.sha256(content.encode("utf-8")).hexdigest()
 
 
-    def save_to_db(self, file_text, filename, extension, title, is_isolated, chat_id, tags="", chunk_size=200):
-        file_hash = self._compute_hash(file_text)
-
-        self.cursor.execute("SELECT id FROM files WHERE hash = ?", (file_hash,))
-        if self.cursor.fetchone():
-            print("Duplicate file ignored.")
-            return
-
-        self.cursor.execute('''
-            INSERT INTO files (filename, extension, title, chat_id, hash, tags)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (filename, extension, title, chat_id, file_hash, tags))
-        file_id = self.cursor.lastrowid
-
-        chunks = [file_text[i:i+chunk_size] for i in range(0, len(file_text), chunk_size)]
-        embeddings = self.embedder.encode(chunks)
-
-        for chunk, emb in zip(chunks, embeddings):
-            emb_blob = pickle.dumps(emb)
-            self.cursor.execute('''
-                INSERT INTO chunks (file_id, content, embedding)
-                VALUES (?, ?, ?)
-            ''', (file_id, chunk, emb_blob))
+    def _known_chunks(self, hashes):
+        # chunk id of every hash already stored
+        hashes = list(hashes)
+        if not hashes:
+            return {}
+        cursor = self.db.execute(
+            f"SELECT hash, id FROM chunks WHERE hash IN ({','.join('?' * len(hashes))})", hashes
+        )
+        return dict(cursor.fetchall())
+
+
+    def save_to_db(self, file_text, filename, extension, title, is_isolated, chat_id, tags="", chunk_tokens=None):
+        return self.ingest(
+            [(file_text, 1, 1)], filename, extension, title, is_isolated, chat_id,
+            tags=tags, chunk_tokens=chunk_tokens
+        )
+
+
+    def ingest(
+        self,
+        pieces,
+        filename,
+        extension,
+        title,
+        is_isolated,
+        chat_id,
+        tags="",
+        chunk_tokens=None,
+        batch_size=64,
+        progress=None
+    ):
+        """
+        Streaming ingestion: `pieces` yields (text, source_done, source_total) and goes through
+        chunk -> embed -> insert in batches of `batch_size` chunks, one transaction per batch.
+        The lock is only held while a batch is written, so queries keep running during a long
+        ingest. The file row has no hash until the end, a failed, cancelled or duplicate ingest
+        is deleted again. Chunks whose text is already stored are shared through file_chunks,
+        only new text is embedded. `progress(chunks_done, source_done, source_total)` runs after
+        every batch and may raise to cancel. Returns the new file id, or None for a duplicate.
+        """
+        hasher = hashlib.sha256()
+        position = [0, 0]
+
+        def texts():
+            for text, done, total in pieces:
+                hasher.update(text.encode("utf-8"))
+                position[:] = [done, total]
+                yield text
+
+        # Structure-aware chunks sized with the embedding model tokenizer
+        chunker = get_chunker(
+            extension,
+            max_tokens=chunk_tokens or self.chunk_tokens,
+            overlap_tokens=self.chunk_overlap,
+            token_counter=self.embedder.count_tokens
+        )
+
+        # No chat (None, '' or a stringified None from older jobs) is stored as NULL
+        chat_id = None if chat_id in (None, "", "None") else str(chat_id)
+
+        # The hash is only known once the whole file is read, the row gets it at the end
+        with self.lock:
+            cursor = self.db.execute('''
+                INSERT INTO files (filename, extension, title, chat_id, hash, tags, is_isolated)
+                VALUES (?, ?, ?, ?, NULL, ?, ?)
+            ''', (filename, extension, title, chat_id, tags, 1 if is_isolated else 0))
+            file_id = cursor.lastrowid
+            self.db.commit()
+        chunks_done = 0
+
+        def flush(batch):
+            nonlocal chunks_done
+            hashes = [self._chunk_hash(chunk) for chunk in batch]
+            texts_by_hash = dict(zip(hashes, batch))
+            # Only text never seen before is embedded, repeated chunks point at the stored one
+            known = self._known_chunks(texts_by_hash)
+            new_hashes = [chunk_hash for chunk_hash in texts_by_hash if chunk_hash not in known]
+            embedded = dict(zip(new_hashes, self.embedder.encode([texts_by_hash[h] for h in new_hashes])))
+
+            while True:
+                with self.lock:
+                    # Looked up again under the lock: another ingest may have stored or removed some meanwhile
+                    known = self._known_chunks(texts_by_hash)
+                    missing = [chunk_hash for chunk_hash in texts_by_hash if chunk_hash not in known]
+                    late = [chunk_hash for chunk_hash in missing if chunk_hash not in embedded]
+                    if not late:
+                        cursor = self.db.execute("SELECT COALESCE(MAX(id), 0) FROM chunks")
+                        first_id = cursor.fetchone()[0] + 1
+                        ids = list(range(first_id, first_id + len(missing)))
+                        known.update(zip(missing, ids))
+                        with self.db.transaction():
+                            self.db.executemany('''
+                                INSERT INTO chunks (id, content, embedding, hash)
+                                VALUES (?, ?, ?, ?)
+                            ''', [
+                                (chunk_id, texts_by_hash[chunk_hash], encode_vector(embedded[chunk_hash], self.vector_dtype), chunk_hash)
+                                for chunk_id, chunk_hash in zip(ids, missing)
+                            ])
+                            # Also add to full-text search index, under the same id
+                            self.db.executemany(
+                                "INSERT INTO content_index (rowid, content) VALUES (?, ?)",
+                                [(chunk_id, texts_by_hash[chunk_hash]) for chunk_id, chunk_hash in zip(ids, missing)]
+                            )
+                            self.db.executemany(
+                                "INSERT INTO file_chunks (file_id, chunk_id, position) VALUES (?, ?, ?)",
+                                [(file_id, known[chunk_hash], chunks_done + offset) for offset, chunk_hash in enumerate(hashes)]
+                            )
+                        if ids:
+                            self.index.add(ids, np.stack([embedded[chunk_hash] for chunk_hash in missing]))
+                        self._invalidate()
+                        break
+                # Removed by another ingest since the first look: embed them without the lock and look again
+                embedded.update(zip(late, self.embedder.encode([texts_by_hash[h] for h in late])))
+            chunks_done += len(batch)
+            if progress:
+                progress(chunks_done, *position)
 
-            self.chunk_texts.append(chunk)
-            self.index.add(np.array([emb]).astype("float32"))
+        try:
+            batch = []
+            for chunk in chunker.iter_chunks(texts()):
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+
+            file_hash = hasher.hexdigest()
+            with self.lock:
+                cursor = self.db.execute("SELECT id FROM files WHERE hash = ?", (file_hash,))
+                if cursor.fetchone() is not None:
+                    print("Duplicate file ignored.")
+                    self.remove_file(file_id)
+                    return None
+                self.db.execute("UPDATE files SET hash = ? WHERE id = ?", (file_hash, file_id))
+                self.db.commit()
+                self.index.save()
+        except BaseException:
+            self.remove_file(file_id)
+            raise
+        return file_id
+
+
+    def _invalidate(self):
+        # Chunks were added or removed: cached scopes and query results no longer hold
+        with self.lock:
+            self._scope_cache.clear()
+            self._query_cache.clear()
+            self.index_version += 1
+
+
+    def query_cache_stats(self):
+        with self.lock:
+            total = self.query_cache_hits + self.query_cache_misses
+            return {
+                "hits": self.query_cache_hits,
+                "misses": self.query_cache_misses,
+                "hit_rate": self.query_cache_hits / total if total else 0.0,
+                "entries": len(self._query_cache),
+                "index_version": self.index_version
+            }
+
+
+    def _resolve_chunks(self, chunk_ids):
+        # One primary key lookup for every hit, returned in the order of `chunk_ids`;
+        # a chunk shared by several files is reported with the oldest of them
+        chunk_ids = [int(chunk_id) for chunk_id in chunk_ids]
+        if not chunk_ids:
+            return []
+        placeholders = ",".join("?" * len(chunk_ids))
+        cursor = self.db.execute(f'''
+            SELECT chunks.id, chunks.content, MIN(files.id), files.filename, files.title, files.chat_id
+            FROM chunks
+            JOIN file_chunks ON file_chunks.chunk_id = chunks.id
+            JOIN files ON files.id = file_chunks.file_id
+            WHERE chunks.id IN ({placeholders})
+            GROUP BY chunks.id
+        ''', chunk_ids)
+        rows = {
+            row[0]: {
+                "id": row[0],
+                "content": row[1],
+                "file_id": row[2],
+                "filename": row[3],
+                "title": row[4],
+                "chat_id": row[5]
+            }
+            for row in cursor.fetchall()
+        }
+        return [rows[chunk_id] for chunk_id in chunk_ids if chunk_id in rows]
+
+
+    def _scope_filter(self, scope, chat_id):
+        # WHERE clause on `files` for a scope, None when every document is visible
+        if scope not in RAG_SCOPES:
+            raise ValueError(f"Unknown RAG scope: {scope}")
+        if scope == "all":
+            return None
+
+        isolated = 1 if scope == "isolated" else 0
+        if chat_id is None:
+            return "files.is_isolated = ?", (isolated,)
+        return (
+            "files.is_isolated = ? AND (files.chat_id IS NULL OR files.chat_id = '' OR files.chat_id = ?)",
+            (isolated, str(chat_id))
+        )
+
+
+    def _scope_chunk_ids(self, scope, chat_id):
+        # Chunk ids the vector search may return as a reusable IdFilter, None when no selector is needed
+        key = (scope, None if chat_id is None else str(chat_id))
+        cached = self._scope_cache.get(key, _UNCACHED)
+        if cached is not _UNCACHED:
+            return cached
+        version = self.index_version
+
+        scope_filter = self._scope_filter(scope, chat_id)
+        allowed = None
+        if scope_filter is not None:
+            where, params = scope_filter
+            cursor = self.db.execute(f'''
+                SELECT DISTINCT file_chunks.chunk_id FROM file_chunks
+                JOIN files ON files.id = file_chunks.file_id
+                WHERE {where}
+            ''', params)
+            allowed = IdFilter(row[0] for row in cursor)
+            if len(allowed) == self.index.ntotal:
+                allowed = None
+
+        with self.lock:
+            # Read without the lock: a write that landed meanwhile already made this stale
+            if version == self.index_version:
+                self._scope_cache[key] = allowed
+        return allowed
+
+
+    def _vector_hits(self, question, k, allowed_ids):
+        # Chunk ids ranked by embedding distance
+        if self.index.ntotal == 0 or (allowed_ids is not None and not allowed_ids):
+            return []
+        query_emb = self.embedder.encode([question]).astype("float32")
+        _, ids = self.index.search(query_emb, k, ids=allowed_ids)
+        return [int(chunk_id) for chunk_id in ids]
+
+
+    def _keyword_hits(self, question, k, scope, chat_id):
+        # Chunk ids ranked by FTS5 bm25 (lower is better, `rank` orders by it)
+        match = build_fts_query(question)
+        if match is None:
+            return []
+        scope_filter = self._scope_filter(scope, chat_id)
+        if scope_filter is None:
+            # Every indexed chunk is visible, no lookup through file_chunks
+            cursor = self.db.execute('''
+                SELECT rowid FROM content_index
+                WHERE content_index MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (match, k))
+            return [row[0] for row in cursor.fetchall()]
+
+        where, params = scope_filter
+        cursor = self.db.execute(f'''
+            SELECT content_index.rowid FROM content_index
+            WHERE content_index MATCH ? AND content_index.rowid IN (
+                SELECT file_chunks.chunk_id FROM file_chunks
+                JOIN files ON files.id = file_chunks.file_id
+                WHERE {where}
+            )
+            ORDER BY rank
+            LIMIT ?
+        ''', (match, *params, k))
+        return [row[0] for row in cursor.fetchall()]
+
+
+    def _fuse(self, ranked_lists):
+        # Reciprocal rank fusion over (weight, ids) lists, best first
+        scores = {}
+        for weight, ids in ranked_lists:
+            for rank, chunk_id in enumerate(ids, start=1):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (self.rrf_k + rank)
+        return sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)
+
+
+    def rag_query(
+        self,
+        question,
+        chat_id=None,
+        k=3,
+        keyword_fallback=True,
+        scope=None,
+        mode=None,
+        vector_weight=None,
+        keyword_weight=None,
+        rerank=None
+    ):
+        key = (
+            self.index_version, normalize_text(question).lower(), scope, None if chat_id is None else str(chat_id),
+            k, keyword_fallback, mode, vector_weight, keyword_weight, rerank
+        )
+        with self.lock:
+            if key in self._query_cache:
+                self._query_cache.move_to_end(key)
+                self.query_cache_hits += 1
+                return list(self._query_cache[key])
+            self.query_cache_misses += 1
+
+        results = self._answer(question, chat_id, k, keyword_fallback, scope, mode, vector_weight, keyword_weight, rerank)
+
+        with self.lock:
+            #? an ingest or delete during the search already moved the version on, the entry would be stale
+            if key[0] == self.index_version:
+                self._query_cache[key] = list(results)
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+        return results
+
+
+    def _answer(self, question, chat_id, k, keyword_fallback, scope, mode, vector_weight, keyword_weight, rerank):
+        # With a reranker the cross-encoder reads `rerank_candidates` first-stage hits and keeps the best k,
+        # outside the lock so scoring never holds up other queries
+        reranking = rerank is not False and self.reranker is not None and self.reranker.available
+        limit = max(k, self.rerank_candidates) if reranking else k
+        results = self._retrieve(question, chat_id, limit, keyword_fallback, scope, mode, vector_weight, keyword_weight)
+        if results is None:
+            return ["No indexed documents found."]
+        if reranking:
+            results = self.reranker.rerank(question, results, k)
 
-            # Also add to full-text search index
-            self.cursor.execute('''
-                INSERT INTO content_index (content, file_id)
-                VALUES (?, ?)
-            ''', (chunk, file_id))
+        if not results:
+            return ["No relevant documents found."]
 
-        self.conn.commit()
-        self._save_faiss_index()
+        return results
 
 
-    def rag_query(self, question, chat_id=None, k=3, keyword_fallback=True):
-        query_emb = self.embedder.encode([question]).astype("float32")
+    def _retrieve(self, question, chat_id, k, keyword_fallback, scope, mode, vector_weight, keyword_weight):
+        # Default scope: global + current chat documents inside a chat, everything otherwise
+        if scope is None:
+            scope = "chat" if chat_id is not None else "all"
+        mode = mode or self.search_mode
+        if mode not in RAG_SEARCH_MODES:
+            raise ValueError(f"Unknown RAG search mode: {mode}")
 
-        if self.index.ntotal == 0:
-            if keyword_fallback:
-                return self.keyword_search(question, k)
-            return ["No indexed documents found."]
+        cursor = self.db.execute("SELECT COUNT(*) FROM chunks")
+        if cursor.fetchone()[0] == 0:
+            return None
 
-        # FAISS search
-        D, I = self.index.search(query_emb, k * 2)  # search wider for filtering
-        faiss_results = []
+        depth = k * self.candidate_factor
+        if mode == "vector":
+            # Search restricted to the scope inside FAISS, so all k results are usable
+            ids = self._vector_hits(question, k, self._scope_chunk_ids(scope, chat_id))
+        elif mode == "keyword":
+            ids = self._keyword_hits(question, k, scope, chat_id)
+        else:
+            # Both legs run on every query and are merged by rank, not by raw score
+            ids = self._fuse([
+                (self.vector_weight if vector_weight is None else vector_weight,
+                 self._vector_hits(question, depth, self._scope_chunk_ids(scope, chat_id))),
+                (self.keyword_weight if keyword_weight is None else keyword_weight,
+                 self._keyword_hits(question, depth, scope, chat_id))
+            ])
+
+        results = []
         seen = set()
-
-        for idx in I[0]:
-            if idx >= len(self.chunk_texts):
-                continue
-
-            # Find which file this chunk belongs to
-            chunk_text = self.chunk_texts[idx]
-            self.cursor.execute('''
-                SELECT files.chat_id FROM chunks
-                JOIN files ON chunks.file_id = files.id
-                WHERE chunks.content = ?
-                LIMIT 1
-            ''', (chunk_text,))
-            row = self.cursor.fetchone()
-            if not row:
-                continue
-            chunk_chat_id = row[0]
-
-            # Prioritize: exact chat match or global (NULL)
-            if chat_id is None or chunk_chat_id == chat_id or chunk_chat_id is None:
-                if chunk_text not in seen:
-                    faiss_results.append(chunk_text)
-                    seen.add(chunk_text)
-            if len(faiss_results) >= k:
+        for hit in self._resolve_chunks(ids):
+            chunk_text = hit["content"]
+            if chunk_text not in seen:
+                results.append(chunk_text)
+                seen.add(chunk_text)
+            if len(results) >= k:
                 break
 
-        # If FAISS result is insufficient and fallback enabled
-        if len(faiss_results) < k and keyword_fallback:
-            needed = k - len(faiss_results)
-            keyword_hits = self.keyword_search(question, needed)
+        # Pure vector search can still top up from the keyword index
+        if mode == "vector" and len(results) < k and keyword_fallback:
+            needed = k - len(results)
+            keyword_hits = self.keyword_search(question, needed, scope=scope, chat_id=chat_id)
             for kw in keyword_hits:
                 if kw not in seen:
-                    faiss_results.append(kw)
+                    results.append(kw)
                     seen.add(kw)
-                    if len(faiss_results) >= k:
+                    if len(results) >= k:
                         break
 
-        if not faiss_results:
-            return ["No relevant documents found."]
-
-        return faiss_results
+        return results
 
     
-    def keyword_search(self, keyword: str, k=3):
-        self.cursor.execute('''
-            SELECT content FROM content_index
-            WHERE content MATCH ?
-            LIMIT ?
-        ''', (keyword, k))
-        return [row[0] for row in self.cursor.fetchall()]
+    def keyword_search(self, keyword: str, k=3, scope="all", chat_id=None):
+        return [hit["content"] for hit in self._resolve_chunks(self._keyword_hits(keyword, k, scope, chat_id))]
 
 
+    @synchronized
     def remove_file(self, file_id):
-        self.cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
-        self.conn.commit()
-        # You should also rebuild FAISS from scratch in real app to remove those vectors
+        cursor = self.db.execute("SELECT COUNT(*) FROM file_chunks WHERE file_id = ?", (file_id,))
+        count = cursor.fetchone()[0]
+
+        # Rows go in one transaction, the vectors right after it; chunks other files share stay
+        with self.db.transaction():
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS removed_chunks (id INTEGER PRIMARY KEY)")
+            self.db.execute("DELETE FROM removed_chunks")
+            self.db.execute('''
+                INSERT OR IGNORE INTO removed_chunks (id)
+                SELECT chunk_id FROM file_chunks WHERE file_id = ?
+            ''', (file_id,))
+            self.db.execute("DELETE FROM file_chunks WHERE file_id = ?", (file_id,))
+            self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            self.db.execute('''
+                DELETE FROM removed_chunks
+                WHERE EXISTS (SELECT 1 FROM file_chunks WHERE file_chunks.chunk_id = removed_chunks.id)
+            ''')
+            cursor = self.db.execute("SELECT id FROM removed_chunks")
+            orphans = [row[0] for row in cursor.fetchall()]
+            self.db.execute("DELETE FROM content_index WHERE rowid IN (SELECT id FROM removed_chunks)")
+            self.db.execute("DELETE FROM chunks WHERE id IN (SELECT id FROM removed_chunks)")
+
+        self.index.remove(orphans)
+        self._invalidate()
+        self.index.save()
+        return count
+
+
+    def _discard_unfinished(self):
+        # Files still without a hash were being ingested when the app stopped
+        cursor = self.db.execute("SELECT id FROM files WHERE hash IS NULL")
+        for (file_id,) in cursor.fetchall():
+            self.remove_file(file_id)
+
+
+    @synchronized
+    def cleanup_orphans(self):
+        # Mappings left behind by deletes made before foreign keys were enabled, then chunks
+        # (and their FTS rows) no file refers to any more
+        with self.db.transaction():
+            self.db.execute("DELETE FROM file_chunks WHERE file_id NOT IN (SELECT id FROM files)")
+            cursor = self.db.execute("SELECT id FROM chunks WHERE id NOT IN (SELECT chunk_id FROM file_chunks)")
+            rows = cursor.fetchall()
+            self.db.execute("DELETE FROM content_index WHERE rowid NOT IN (SELECT chunk_id FROM file_chunks)")
+            self.db.execute("DELETE FROM chunks WHERE id NOT IN (SELECT chunk_id FROM file_chunks)")
+
+        if rows:
+            self.index.remove([row[0] for row in rows])
+            self._invalidate()
+            self.index.save()
+        return len(rows)
+
+
+    @synchronized
+    def compact(self):
+        # Purge orphans, rewrite the index from the live rows and reclaim disk space
+        removed = self.cleanup_orphans()
+        self._rebuild_faiss_index()
+        self._invalidate()
+        self.db.execute("INSERT INTO content_index(content_index) VALUES('optimize')")
+        self.db.commit()
+        self.db.execute("VACUUM")
+        return {"orphans_removed": removed, "vectors": self.index.ntotal}
 
 
 
     def load_all_rag_files(self):
-        self.cursor.execute("SELECT id, filename, extension, title, chat_id, tags FROM files")
-        rows = self.cursor.fetchall()
+        cursor = self.db.execute(
+            "SELECT id, filename, extension, title, chat_id, tags, is_isolated FROM files WHERE hash IS NOT NULL"
+        )
+        rows = cursor.fetchall()
         files = [
         {
             "id": row[0],
@@ -185,16 +773,17 @@ class RAGServices:
             "extension": row[2],
             "title": row[3],
             "chat_id": row[4],
-            "tags": row[5]
+            "tags": row[5],
+            "is_isolated": bool(row[6])
         }
         for row in rows
         ]
         return {"files": files}
 
     def close(self):
-        self.conn.commit()
-        self.conn.close()
-        self._save_faiss_index()
+        with self.lock:
+            self.db.close()
+            self.index.save()
 
 
     def __del__(self):
@@ -1,32 +1,69 @@
+import json
+import math
 import os
-import sqlite3
-import numpy as np
-import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
+import threading
 
 from utils.sql_to_json import rows_to_json
+from utils.synchronized import synchronized
+from utils.vector_codec import encode_vector, load_matrix, migrate_vector_table
+from services.database import Database
+from services.embeddings import EmbeddingEngine, get_embedding_engine
+from services.reranker import Reranker
+from services.vector_index import VectorIndex
+
+#? retrieval scopes: the current chat, memories not tied to a chat, both, or everything
+MEMORY_SCOPES = ("chat", "global", "both", "all")
+#? memories re-embedded per encode call when the embedding model changes
+REEMBED_BATCH_SIZE = 256
+
 
 class MemoryServices:
-    def __init__(self):
+    def __init__(
+        self,
+        embedder: EmbeddingEngine = None,
+        vector_dtype: str = "float32",
+        candidate_factor: int = 4,
+        half_life_days: float = 30.0,
+        recency_floor: float = 0.5,
+        weight_boost: float = 0.25,
+        duplicate_similarity: float = 0.92,
+        reranker: Reranker = None,
+        rerank_candidates: int = 20
+    ):
         #? get path for the db
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         db_folder = os.path.join(base_dir, "db")
         os.makedirs(db_folder, exist_ok=True)
         self.db_path = os.path.join(db_folder, "memory.db")
-        #? embedding the memory
-        self.embedding_dim = 384
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
+        self.index_path = os.path.join(db_folder, "memory.index")
+        #? embedding the memory (model shared with the other services)
+        self.embedder = embedder or get_embedding_engine()
+        self.embedding_dim = self.embedder.dimension
+        #? vectors are stored as raw float32 (or float16) bytes
+        self.vector_dtype = vector_dtype
+        #? ranking: similarity x stored weight x time decay over `candidate_factor * k` hits
+        self.candidate_factor = candidate_factor
+        self.half_life_days = half_life_days
+        self.recency_floor = recency_floor
+        self.weight_boost = weight_boost
+        #? cosine similarity above which a new memory reinforces an existing one
+        self.duplicate_similarity = duplicate_similarity
+        #? optional cross-encoder pass over the first `rerank_candidates` ranked memories
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
 
-        #? get connection and cursor 
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+        #? WAL database with a connection per thread, the lock keeps the table and the index in step
+        self.lock = threading.RLock()
+        self.db = Database(self.db_path)
         self._init_tables()
+        migrate_vector_table(self.db.connection(), "memories", self.vector_dtype)
+        reembedded = self._sync_embedding_model()
+        self._load_index(force_rebuild=reembedded)
 
 
     #* start the init table 
     def _init_tables(self):
-        self.cursor.execute('''
+        self.db.execute('''
             CREATE TABLE IF NOT EXISTS memories (
                 id INTEGER PRIMARY KEY,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -36,79 +73,253 @@ class MemoryServices:
                 embedding BLOB
             )
         ''')
-        self.conn.commit()
+        #? last time a memory was written or reinforced, drives the time decay
+        cursor = self.db.execute("PRAGMA table_info(memories)")
+        if "updated_at" not in [row[1] for row in cursor.fetchall()]:
+            self.db.execute("ALTER TABLE memories ADD COLUMN updated_at DATETIME")
+            self.db.execute("UPDATE memories SET updated_at = created_at")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_memories_chat_id ON memories(chat_id)")
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS vector_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        self.db.commit()
+
+
+    #* re-embed stored memories when the embedding backend changed
+    def _sync_embedding_model(self) -> bool:
+        cursor = self.db.execute("SELECT value FROM vector_meta WHERE key = 'model'")
+        row = cursor.fetchone()
+        #? databases older than the meta table were embedded by the default model
+        stored_model = row[0] if row else "all-MiniLM-L6-v2"
+
+        reembedded = False
+        if stored_model != self.embedder.model_name:
+            total = self.db.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+            if total:
+                print(f"Re-embedding {total} memories for {self.embedder.model_name}")
+            #? one batch in memory at a time, committed as it goes
+            last_id = -1
+            while True:
+                cursor = self.db.execute(
+                    "SELECT id, content FROM memories WHERE id > ? ORDER BY id LIMIT ?", (last_id, REEMBED_BATCH_SIZE)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                embeddings = self.embedder.encode([content for _, content in rows])
+                self.db.executemany(
+                    "UPDATE memories SET embedding = ? WHERE id = ?",
+                    [(encode_vector(emb, self.vector_dtype), mem_id) for (mem_id, _), emb in zip(rows, embeddings)]
+                )
+                self.db.commit()
+                last_id = rows[-1][0]
+                reembedded = True
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO vector_meta (key, value) VALUES ('model', ?)", (self.embedder.model_name,)
+        )
+        self.db.commit()
+        return reembedded
+
+
+    #* open the persisted memory index, rebuilding it from the table when out of sync
+    def _load_index(self, force_rebuild: bool = False):
+        self.index = VectorIndex(self.index_path, self.embedding_dim, vector_source=self._stored_vectors)
+        cursor = self.db.execute("SELECT COUNT(*) FROM memories")
+        count = cursor.fetchone()[0]
+        if force_rebuild or self.index.ntotal != count:
+            self._rebuild_index()
+
+
+    #* every memory vector, read by the index when it trains or rebuilds in the background
+    #? `ids` picks single rows for an exact filtered search, read without the lock like other searches
+    def _stored_vectors(self, ids=None):
+        if ids is not None:
+            return load_matrix(
+                self.db.connection(), "memories", self.embedding_dim, self.vector_dtype,
+                where="WHERE id IN (SELECT value FROM json_each(?))", params=(json.dumps(ids.tolist()),)
+            )
+        with self.lock:
+            return load_matrix(self.db.connection(), "memories", self.embedding_dim, self.vector_dtype)
+
+
+    def _rebuild_index(self):
+        ids, vectors = self._stored_vectors()
+        self.index.rebuild(ids, vectors)
+        self.index.save()
+
+
+    #* similarity of unit vectors from their squared L2 distance
+    @staticmethod
+    def _similarity(distance: float) -> float:
+        return 1.0 - float(distance) / 2.0
+
+
+    #* near-duplicate of an already stored memory, reinforced instead of inserted again
+    #? only memories of the same chat or global ones qualify, another chat's memory is never merged into
+    def _reinforce_duplicate(self, content: str, embedding, weight, chat_id: str = None) -> int:
+        allowed_ids = self._scope_ids("both", chat_id)
+        if not allowed_ids:
+            return None
+        distances, ids = self.index.search(embedding, 1, ids=allowed_ids)
+        if len(ids) == 0 or self._similarity(distances[0]) < self.duplicate_similarity:
+            return None
+
+        memory_id = int(ids[0])
+        cursor = self.db.execute("SELECT content FROM memories WHERE id = ?", (memory_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        #? the longer wording usually carries more detail, keep it
+        if len(content.split()) > len(row[0].split()):
+            self.db.execute('''
+                UPDATE memories SET content = ?, embedding = ? WHERE id = ?
+            ''', (content, encode_vector(embedding, self.vector_dtype), memory_id))
+            self.index.replace([memory_id], embedding)
+
+        self.db.execute('''
+            UPDATE memories
+            SET weight = MAX(COALESCE(weight, 1), ?) + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (weight or 1, memory_id))
+        self.db.commit()
+        self.index.save()
+        return memory_id
 
 
     #* Save a new memory (with optional chat_id)
     def save(self, content: str, chat_id: str = None):
-        #? embed the content
+        #? embed the content before taking the lock, readers never wait for the model
         embedding = self.embedder.encode([content["content"]])[0]
-        emb_blob = pickle.dumps(embedding)
-
-        #? execute the SQL command
-        self.cursor.execute('''
-            INSERT INTO memories (chat_id, content, weight,embedding)
-            VALUES (?, ?, ?,?)
-        ''', (chat_id, content["content"], content["weight"] ,emb_blob))
-        self.conn.commit()
+        emb_blob = encode_vector(embedding, self.vector_dtype)
+
+        with self.lock:
+            if self._reinforce_duplicate(content["content"], embedding, content.get("weight"), chat_id) is not None:
+                return
+
+            #? execute the SQL command
+            cursor = self.db.execute('''
+                INSERT INTO memories (chat_id, content, weight,embedding, updated_at)
+                VALUES (?, ?, ?,?, CURRENT_TIMESTAMP)
+            ''', (chat_id, content["content"], content["weight"] ,emb_blob))
+            self.db.commit()
+
+            #? keep the index in step with the table
+            self.index.add([cursor.lastrowid], embedding)
+            self.index.save()
         
         
     def create_memory_manually(self, content:str, weight:int):
-        #? embed the content
+        #? embed the content before taking the lock
         embedding = self.embedder.encode([content])[0]
-        emb_blob = pickle.dumps(embedding)
-
-        #? execute the SQL command
-        self.cursor.execute('''
-            INSERT INTO memories (content, weight,embedding)
-            VALUES ( ?, ?,?)
-        ''', (content, weight ,emb_blob))
-        self.conn.commit()
-        id = self.cursor.lastrowid
+        emb_blob = encode_vector(embedding, self.vector_dtype)
+
+        with self.lock:
+            id = self._reinforce_duplicate(content, embedding, weight)
+
+            if id is None:
+                #? execute the SQL command
+                cursor = self.db.execute('''
+                    INSERT INTO memories (content, weight,embedding, updated_at)
+                    VALUES ( ?, ?,?, CURRENT_TIMESTAMP)
+                ''', (content, weight ,emb_blob))
+                self.db.commit()
+                id = cursor.lastrowid
+                self.index.add([id], embedding)
+                self.index.save()
         
-        self.cursor.execute("SELECT id, content, created_at FROM memories WHERE id = ?",(id,))
-        row = self.cursor.fetchone()
+        cursor = self.db.execute("SELECT id, content, created_at FROM memories WHERE id = ?",(id,))
+        row = cursor.fetchone()
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json([row], labels)
         return json_data
 
 
-    #* Fetch similar memories by chat_id (optional)
-    def fetch(self, query: str, chat_id: str = None, k: int = 3):
-        #? get the memories based on the situation 
-        self.cursor.execute('''
-        SELECT id, content, embedding FROM memories
-        ORDER BY created_at
-        ''')
+    #* ids of the memories visible in a scope, None when nothing has to be filtered
+    def _scope_ids(self, scope: str, chat_id: str = None):
+        if scope not in MEMORY_SCOPES:
+            raise ValueError(f"Unknown memory scope: {scope}")
+        if scope == "all":
+            return None
+
+        global_clause = "(chat_id IS NULL OR chat_id = '')"
+        if scope == "global" or chat_id is None:
+            cursor = self.db.execute(f"SELECT id FROM memories WHERE {global_clause}")
+        elif scope == "chat":
+            cursor = self.db.execute("SELECT id FROM memories WHERE chat_id = ?", (str(chat_id),))
+        else:
+            cursor = self.db.execute(f"SELECT id FROM memories WHERE chat_id = ? OR {global_clause}", (str(chat_id),))
+        return [row[0] for row in cursor.fetchall()]
+
+
+    #* Fetch similar memories, scoped to the chat, global memories, both or all
+    #* no scope: this chat and global memories inside a chat, everything otherwise
+    def fetch(self, query: str, chat_id: str = None, k: int = 3, scope: str = None, rerank: bool = None):
+        if scope is None:
+            scope = "both" if chat_id is not None else "all"
+        #? the cross-encoder reorders the best `rerank_candidates` outside the lock
+        reranking = rerank is not False and self.reranker is not None and self.reranker.available
+        if not reranking:
+            return self._ranked(query, chat_id, k, scope)
+        candidates = self._ranked(query, chat_id, max(k, self.rerank_candidates), scope)
+        return self.reranker.rerank(query, candidates, k)
 
-        #? fetch all items
-        rows = self.cursor.fetchall()
-        if not rows:
-            return []
 
-        #? index the memories
-        index = faiss.IndexFlatL2(self.embedding_dim)
-        memory_texts = []
-        memory_ids = []
+    #* memories ranked by similarity, weight and recency
+    #? read-only: the thread's own WAL connection and the index lock, not the service lock
+    def _ranked(self, query: str, chat_id: str, k: int, scope: str):
+        if self.index.ntotal == 0:
+            return []
 
-        for mem_id, content, emb_blob in rows:
-            memory_ids.append(mem_id)
-            memory_texts.append(content)
-            index.add(np.array([pickle.loads(emb_blob)]))
+        allowed_ids = self._scope_ids(scope, chat_id)
+        if allowed_ids is not None and not allowed_ids:
+            return []
 
+        #? one search against the persisted index, the scope is applied inside FAISS
         query_emb = self.embedder.encode([query])
-        D, I = index.search(np.array(query_emb), k)
-        return [memory_texts[i] for i in I[0]]
+        distances, ids = self.index.search(query_emb, k * self.candidate_factor, ids=allowed_ids)
+        if len(ids) == 0:
+            return []
+
+        #? resolve the candidates by primary key with what the ranking needs
+        placeholders = ",".join("?" * len(ids))
+        cursor = self.db.execute(f'''
+            SELECT id, content, COALESCE(weight, 1),
+                   julianday('now') - julianday(COALESCE(updated_at, created_at))
+            FROM memories WHERE id IN ({placeholders})
+        ''', [int(mem_id) for mem_id in ids])
+        rows = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        ranked = []
+        for distance, mem_id in zip(distances, ids):
+            if int(mem_id) not in rows:
+                continue
+            content, weight, age_days = rows[int(mem_id)]
+            ranked.append((self._score(distance, weight, age_days), content))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return [content for _, content in ranked[:k]]
+
+
+    #* vector similarity boosted by the stored weight and faded by age
+    def _score(self, distance: float, weight: int, age_days: float) -> float:
+        similarity = self._similarity(distance)
+        weight_factor = 1.0 + self.weight_boost * math.log1p(max(weight or 1, 1) - 1)
+        decay = 0.5 ** (max(age_days or 0.0, 0.0) / self.half_life_days)
+        return similarity * weight_factor * (self.recency_floor + (1.0 - self.recency_floor) * decay)
 
 
 
     #* Get all memories
     def get_all(self):
-        self.cursor.execute("SELECT id, content, created_at FROM memories ORDER BY created_at")
-        rows = self.cursor.fetchall()
+        cursor = self.db.execute("SELECT id, content, created_at FROM memories ORDER BY created_at")
+        rows = cursor.fetchall()
         
-        labels = [desc[0] for desc in self.cursor.description]
+        labels = [desc[0] for desc in cursor.description]
         json_data = rows_to_json(rows, labels)
         return json_data
 
@@ -117,34 +328,44 @@ class MemoryServices:
     #* Update a memory's content by ID
     def update(self, memory_id: int, new_content: str):
         new_embedding = self.embedder.encode([new_content])[0]
-        emb_blob = pickle.dumps(new_embedding)
+        emb_blob = encode_vector(new_embedding, self.vector_dtype)
 
-        self.cursor.execute('''
-            UPDATE memories
-            SET content = ?, embedding = ?
-            WHERE id = ?
-        ''', (new_content, emb_blob, memory_id))
-        self.conn.commit()
+        with self.lock:
+            cursor = self.db.execute('''
+                UPDATE memories
+                SET content = ?, embedding = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (new_content, emb_blob, memory_id))
+            self.db.commit()
+
+            if cursor.rowcount:
+                self.index.replace([memory_id], new_embedding)
+                self.index.save()
         
         
     #* Update a memory's content by ID
+    @synchronized
     def delete(self, memory_id: int):
-        self.cursor.execute('''
+        self.db.execute('''
             DELETE FROM memories WHERE id = ?''', (memory_id,))
-        self.conn.commit()
+        self.db.commit()
+
+        if self.index.remove([memory_id]):
+            self.index.save()
 
 
 
     #* Return memory count
     def get_size(self):
-        self.cursor.execute("SELECT COUNT(*) FROM memories")
-        return self.cursor.fetchone()[0]
+        cursor = self.db.execute("SELECT COUNT(*) FROM memories")
+        return cursor.fetchone()[0]
 
 
 
     def close(self):
-        self.conn.commit()
-        self.conn.close()
+        with self.lock:
+            self.db.close()
+            self.index.save()
 
 
 
@@ -0,0 +1,150 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from services.embeddings.cache import normalize_text
+from utils.micro_batcher import MicroBatcher
+
+# Import the optional cross-encoder runtime
+try:
+    from sentence_transformers import CrossEncoder
+    CROSS_ENCODER_AVAILABLE = True
+except ImportError:
+    CROSS_ENCODER_AVAILABLE = False
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class Reranker:
+    """
+    Second retrieval stage: a small cross-encoder reads (query, passage) pairs and
+    scores how well each passage answers the query, which ranks far better than
+    vector distance. The model loads on first use inside a single worker thread;
+    concurrent calls are merged into batches of up to `max_batch_size` pairs and
+    scores are kept in an LRU keyed by model + normalized query + passage.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        cache_size: int = 20_000
+    ):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+        self.model = None
+        #? set when the model cannot be loaded, retrieval then keeps its first-stage order
+        self.load_error: Optional[str] = None if CROSS_ENCODER_AVAILABLE else "sentence-transformers is not installed"
+
+        self.lock = threading.Lock()
+        self._cache: "OrderedDict[str, float]" = OrderedDict()
+        self._closed = False
+        self._batcher = MicroBatcher(
+            self._score_batch, max_batch_size, max_wait_ms,
+            name="reranker", closed_message="Reranker is closed"
+        )
+
+
+    @property
+    def available(self) -> bool:
+        return self.load_error is None and not self._closed
+
+
+    #* relevance score of every passage for the query, higher is better
+    def score(self, query: str, passages: Sequence[str]) -> np.ndarray:
+        passages = list(passages)
+        if not passages:
+            return np.zeros(0, dtype="float32")
+        if not self.available:
+            raise RuntimeError(self.load_error or "Reranker is closed")
+
+        keys = [self._key(query, passage) for passage in passages]
+        scores = np.empty(len(passages), dtype="float32")
+        missing = {}
+        with self.lock:
+            for position, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[position] = self._cache[key]
+                else:
+                    missing.setdefault(key, []).append(position)
+            self.hits += len(passages) - sum(len(positions) for positions in missing.values())
+            self.misses += sum(len(positions) for positions in missing.values())
+        if not missing:
+            return scores
+
+        #? every distinct missing pair is scored once
+        missing_keys = list(missing.keys())
+        computed = self._batcher.submit([(query, passages[missing[key][0]]) for key in missing_keys])
+
+        with self.lock:
+            for key, value in zip(missing_keys, computed):
+                scores[missing[key]] = value
+                self._cache[key] = float(value)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scores
+
+
+    #* passages reordered by cross-encoder score, the first-stage order is kept if the model is unavailable
+    def rerank(self, query: str, passages: Sequence[str], k: Optional[int] = None) -> List[str]:
+        passages = list(passages)
+        k = len(passages) if k is None else k
+        if len(passages) <= 1 or not self.available:
+            return passages[:k]
+        try:
+            scores = self.score(query, passages)
+        except Exception as e:
+            print(f"Reranking failed, keeping retrieval order: {e}")
+            return passages[:k]
+        #? stable, ties keep the retrieval order
+        order = sorted(range(len(passages)), key=lambda position: -scores[position])
+        return [passages[position] for position in order[:k]]
+
+
+    def _key(self, query: str, passage: str) -> str:
+        payload = f"{self.model_name}\x00{normalize_text(query)}\x00{normalize_text(passage)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+
+    #* runs on the batcher's worker thread: loads the model once, then scores the merged pairs
+    def _score_batch(self, pairs: List[tuple]) -> np.ndarray:
+        try:
+            if self.model is None:
+                self.model = CrossEncoder(self.model_name)
+            return np.asarray(
+                self.model.predict(pairs, batch_size=self.max_batch_size, show_progress_bar=False),
+                dtype="float32"
+            ).reshape(-1)
+        except Exception as e:
+            if self.model is None:
+                self.load_error = f"Failed to load {self.model_name}: {e}"
+                print(self.load_error)
+            raise
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "model": self.model_name,
+                "loaded": self.model is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "cached_pairs": len(self._cache)
+            }
+
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._batcher.close()
@@ -0,0 +1,105 @@
+import os
+
+from fastapi import Request
+
+from services.chat_services import ChatServices
+from services.library_services import RAGServices
+from services.memory_services import MemoryServices
+from services.embeddings import EmbeddingEngine, get_embedding_engine, load_embedding_settings
+from services.extraction import ExtractionService
+from services.ingestion_jobs import IngestionJobs
+from services.reranker import Reranker
+
+
+class ServiceRegistry:
+    """
+    Process-wide holder for the long lived services.
+    Every service is built once when the app starts and closed on shutdown,
+    routes receive them through the dependency getters below.
+    """
+
+    def __init__(self):
+        self.embedder: EmbeddingEngine = None
+        self.reranker: Reranker = None
+        self.chat: ChatServices = None
+        self.rag: RAGServices = None
+        self.memory: MemoryServices = None
+        self.extraction: ExtractionService = None
+        self.jobs: IngestionJobs = None
+
+
+    #* build every service once
+    def start(self):
+        self.embedder = get_embedding_engine()
+        settings = load_embedding_settings()
+        #? cross-encoder reranking is off unless a model is set ("reranker" setting or RERANKER_MODEL)
+        reranker_model = settings.get("reranker")
+        if reranker_model:
+            self.reranker = Reranker(reranker_model)
+        #? stored vectors are converted once when "vector_dtype" changed since the last start
+        vector_dtype = settings.get("vector_dtype") or "float32"
+        self.chat = ChatServices()
+        self.rag = RAGServices(embedder=self.embedder, reranker=self.reranker, vector_dtype=vector_dtype)
+        self.memory = MemoryServices(embedder=self.embedder, reranker=self.reranker, vector_dtype=vector_dtype)
+        #? EXTRACTION_WORKERS processes for PDF pages and files, one per core by default
+        self.extraction = ExtractionService(workers=int(os.environ.get("EXTRACTION_WORKERS", 0)) or None)
+        #? uploads are indexed by INGESTION_WORKERS background threads, jobs left by the last run resume
+        self.jobs = IngestionJobs(self.rag, self.extraction, workers=int(os.environ.get("INGESTION_WORKERS", 1)))
+        self.jobs.start()
+
+
+    #* close connections and flush indexes
+    def shutdown(self):
+        #? the ingestion workers write to the RAG service, they stop first
+        if self.jobs is not None:
+            try:
+                self.jobs.close()
+            except Exception as e:
+                print(f"Error closing IngestionJobs: {e}")
+            self.jobs = None
+
+        for service in (self.chat, self.rag, self.memory):
+            if service is None:
+                continue
+            try:
+                service.close()
+            except Exception as e:
+                print(f"Error closing {type(service).__name__}: {e}")
+        self.chat = None
+        self.rag = None
+        self.memory = None
+
+        if self.extraction is not None:
+            self.extraction.close()
+            self.extraction = None
+
+        if self.reranker is not None:
+            self.reranker.close()
+            self.reranker = None
+
+        #? stop the embedding worker last, the services above may still flush
+        if self.embedder is not None:
+            self.embedder.close()
+            self.embedder = None
+
+
+
+#? ----- Dependency getters ------
+def get_registry(request: Request) -> ServiceRegistry:
+    return request.app.state.services
+
+
+def get_chat_services(request: Request) -> ChatServices:
+    return get_registry(request).chat
+
+
+def get_rag_services(request: Request) -> RAGServices:
+    return get_registry(request).rag
+
+
+def get_memory_services(request: Request) -> MemoryServices:
+    return get_registry(request).memory
+
+
+def get_ingestion_jobs(request: Request) -> IngestionJobs:
+    return get_registry(request).jobs
@@ -0,0 +1,833 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+#? flat: exact brute force / hnsw: graph over full vectors / ivfpq: inverted lists over PQ codes
+INDEX_KINDS = ("flat", "hnsw", "ivfpq")
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_FORMAT = 1
+
+#? search-time knobs tried from cheapest to most accurate while checking recall
+_EF_SEARCH_STEPS = (16, 32, 64, 128, 256)
+_NPROBE_STEPS = (8, 16, 32, 64, 128, 256)
+#? upper bound for efSearch when a filter leaves only a fraction of an hnsw segment
+_MAX_FILTERED_EF = 1024
+
+
+def _write_atomic(path: str, write: Callable[[str], None]):
+    #? write to a temp file then rename so a crash never leaves half a file
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _contains(sorted_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    positions = np.searchsorted(sorted_ids, ids).clip(max=len(sorted_ids) - 1)
+    return sorted_ids[positions] == ids
+
+
+class IdFilter:
+    """
+    Row ids a search is restricted to, sorted and unique. Built once and passed
+    to any number of `VectorIndex.search` calls: the FAISS selector and each
+    segment's share of the ids are computed on first use and kept.
+    """
+
+    def __init__(self, ids: Iterable[int]):
+        if not isinstance(ids, np.ndarray):
+            ids = np.fromiter(ids, dtype="int64")
+        self.ids = np.unique(ids.astype("int64", copy=False))
+        self._selector = None
+        self._segment_ids = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def selector(self):
+        if self._selector is None:
+            self._selector = faiss.IDSelectorBatch(self.ids)
+        return self._selector
+
+    #? the ids stored in a written segment (immutable, so cached by its file name)
+    def _in_segment(self, segment: "_Segment") -> np.ndarray:
+        key = (segment.seq, segment.name)
+        here = self._segment_ids.get(key)
+        if here is None:
+            here = self.ids[_contains(segment.ids, self.ids)]
+            if segment.name is not None:
+                if len(self._segment_ids) > 64:
+                    #? entries of merged-away segments
+                    self._segment_ids.clear()
+                self._segment_ids[key] = here
+        return here
+
+
+
+class _Segment:
+    """One piece of the index: a FAISS index, the sorted row ids it holds and its sequence number"""
+
+    def __init__(self, seq: int, index, ids: np.ndarray, name: Optional[str] = None):
+        self.seq = seq
+        self.index = index
+        self.ids = ids
+        self.name = name
+
+
+
+class VectorIndex:
+    """
+    FAISS index keyed by row id and persisted as a directory of segments.
+    Callers add, replace and remove vectors by the id of the SQLite row they
+    belong to, so a search hit resolves straight back to its row.
+
+    New vectors go to an in-memory delta; save() writes it as a new immutable
+    segment and swaps `manifest.json` (both through a rename), so a save costs
+    the size of the delta, not of the index. Removing a vector stored in a
+    written segment records a tombstone (row id -> sequence number: copies in
+    older segments are dead). Searches fan out over every segment.
+
+    A background compactor merges segments when there are more than
+    `max_segments`, when tombstones pass `tombstone_ratio`, when the deltas
+    outgrow the base or every `compact_interval` seconds. While a merge runs,
+    segments written after it started are still folded together once there
+    are more than `max_segments` (in the background, or right away in save()
+    when even those pass `max_segments`), so a long ANN build cannot pile them
+    up. A merge that reaches
+    `ann_threshold` vectors builds an HNSW or IVF-PQ base instead of a flat one,
+    tuned until it reaches `min_recall` against exact search. Once the base is
+    an ANN index, merges append the live delta vectors to a copy of it (dead
+    base rows are relabelled out of an HNSW graph, removed from IVF lists);
+    it is only trained again when dead rows pass `tombstone_ratio`.
+    `vector_source` returns (ids, vectors) for every row, or for the given
+    `ids`; it is only needed for IVF-PQ, whose codes cannot be turned back
+    into the original vectors (retraining, exact filtered searches).
+
+    A filtered search (`ids`) that leaves at most `exact_filter_limit` rows of an
+    ANN segment is answered exactly: those rows are compared directly, from the
+    graph's stored vectors (hnsw) or from `vector_source` (ivf-pq; without it
+    every inverted list is probed), since a graph walk or a few probed lists
+    rarely reach a handful of scattered rows. Larger filters raise efSearch /
+    nprobe in proportion to how selective they are.
+
+    With `mmap` written segments are mapped read-only instead of read into RAM.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int,
+        ann_kind: str = "hnsw",
+        ann_threshold: int = 100_000,
+        vector_source: Optional[Callable[..., Tuple[np.ndarray, np.ndarray]]] = None,
+        min_recall: float = 0.9,
+        tombstone_ratio: float = 0.2,
+        recall_queries: int = 200,
+        mmap: bool = False,
+        max_segments: int = 8,
+        compact_interval: float = 600.0,
+        exact_filter_limit: int = 8192
+    ):
+        if ann_kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind: {ann_kind}")
+        self.path = path
+        self.dir = path + ".d"
+        self.dimension = dimension
+        self.ann_kind = ann_kind
+        self.ann_threshold = ann_threshold
+        self.vector_source = vector_source
+        self.min_recall = min_recall
+        self.tombstone_ratio = tombstone_ratio
+        self.recall_queries = recall_queries
+        self.mmap = mmap
+        self.max_segments = max_segments
+        self.compact_interval = compact_interval
+        self.exact_filter_limit = exact_filter_limit
+
+        self.lock = threading.RLock()
+        self._segments: List[_Segment] = []
+        self._tombstones = {}
+        self._masked = 0
+        self._mask_cache = {}
+        self._dirty = False
+        self._active = None
+        self._mmap_failed = False
+
+        #? background merge state: rebuild() bumps the generation so a stale merge is thrown away
+        self._build_thread = None
+        self._build_targets = []
+        #? minor merge of the segments written since `_build_thread` started
+        self._side_thread = None
+        self._side_targets = []
+        self._generation = 0
+        self._retry_at = 0
+        self._last_compaction = time.time()
+
+        self._load()
+
+
+    def _new_flat(self):
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
+
+
+    def _open_active(self, seq: int):
+        self._active = _Segment(seq, self._new_flat(), np.empty(0, dtype="int64"))
+
+
+    #* load the manifest, or the single-file index written by older versions
+    def _load(self):
+        manifest_path = os.path.join(self.dir, MANIFEST_NAME)
+        next_seq = 1
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                if manifest.get("dimension") != self.dimension:
+                    raise ValueError(f"dimension {manifest.get('dimension')} != {self.dimension}")
+                for entry in manifest["segments"]:
+                    index = self._read(os.path.join(self.dir, entry["index"]))
+                    ids = np.load(os.path.join(self.dir, entry["ids"]))
+                    self._segments.append(_Segment(entry["seq"], index, ids, entry["index"]))
+                if manifest.get("tombstones"):
+                    pairs = np.load(os.path.join(self.dir, manifest["tombstones"]))
+                    self._tombstones = {int(row_id): int(seq) for row_id, seq in pairs}
+                next_seq = manifest["next_seq"]
+            except Exception as e:
+                #? the owner sees ntotal out of step with its table and rebuilds
+                print(f"Ignoring vector index {self.dir}: {e}")
+                self._segments, self._tombstones, next_seq = [], {}, 1
+        elif os.path.exists(self.path):
+            legacy = self._load_legacy()
+            if legacy is not None:
+                self._segments.append(_Segment(0, legacy, np.sort(faiss.vector_to_array(legacy.id_map))))
+                self._dirty = True
+
+        self._recount_masked()
+        self._open_active(next_seq)
+
+
+    def _load_legacy(self):
+        if os.path.exists(self.path + ".pending") or os.path.exists(self.path + ".deleted.npy"):
+            #? hnsw side files of the single-file layout, cheaper to rebuild than to convert
+            print(f"Ignoring {self.path}: rebuilt into segments")
+            return None
+        try:
+            index = faiss.read_index(self.path)
+        except Exception as e:
+            print(f"Failed to read vector index {self.path}: {e}")
+            return None
+        if not hasattr(index, "id_map"):
+            #? positional index from before ids were used, the owner rebuilds it
+            print(f"Ignoring {self.path}: not an id-mapped index")
+        elif index.d != self.dimension:
+            print(f"Ignoring {self.path}: dimension {index.d} != {self.dimension}")
+        else:
+            return index
+        return None
+
+
+    @staticmethod
+    def _mmap_flags(path: str) -> int:
+        #? ivf lists map through IO_FLAG_MMAP alone (on-disk lists), adding IO_FLAG_MMAP_IFC makes
+        #? the read fail; flat codes (flat / hnsw storage) map through IO_FLAG_MMAP_IFC
+        with open(path, "rb") as f:
+            fourcc = f.read(4)
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        if not fourcc.startswith(b"Iw"):
+            flags |= getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        return flags
+
+
+    def _read(self, path: str):
+        if self.mmap:
+            #? pages of a mapped segment load on demand
+            try:
+                return faiss.read_index(path, self._mmap_flags(path))
+            except Exception as e:
+                if not self._mmap_failed:
+                    print(f"Cannot memory-map segments of {self.dir}, loading them instead: {e}")
+                self._mmap_failed = True
+        return faiss.read_index(path)
+
+
+    @staticmethod
+    def _inner(index):
+        #? flat and hnsw sit behind an id map, ivf stores the row ids itself
+        if hasattr(index, "id_map"):
+            return faiss.downcast_index(index.index)
+        return index
+
+
+    @classmethod
+    def _kind_of(cls, index) -> str:
+        inner = cls._inner(index)
+        if isinstance(inner, faiss.IndexHNSW):
+            return "hnsw"
+        if isinstance(inner, faiss.IndexIVF):
+            return "ivfpq"
+        return "flat"
+
+
+    #* kind of the base (oldest) segment, deltas are always flat
+    @property
+    def kind(self) -> str:
+        with self.lock:
+            return self._kind_of(self._segments[0].index) if self._segments else "flat"
+
+
+    @property
+    def ntotal(self) -> int:
+        with self.lock:
+            return sum(len(segment.ids) for segment in self._segments) - self._masked + self._active.index.ntotal
+
+
+    @property
+    def segment_count(self) -> int:
+        with self.lock:
+            return len(self._segments) + (1 if self._active.index.ntotal else 0)
+
+
+    @property
+    def building(self) -> bool:
+        return self._build_thread is not None
+
+
+    #* block until the running background merges finished
+    def wait(self):
+        for thread in (self._build_thread, self._side_thread):
+            if thread is not None:
+                thread.join()
+
+
+    def _recount_masked(self):
+        self._mask_cache = {}
+        self._masked = 0
+        if not self._tombstones:
+            return
+        tomb_ids = np.fromiter(self._tombstones.keys(), dtype="int64", count=len(self._tombstones))
+        tomb_seqs = np.fromiter(self._tombstones.values(), dtype="int64", count=len(self._tombstones))
+        for segment in self._segments:
+            self._masked += int((_contains(segment.ids, tomb_ids) & (tomb_seqs > segment.seq)).sum())
+
+
+    #? ids whose copy in `segment` is dead
+    def _segment_mask(self, segment: _Segment) -> np.ndarray:
+        mask = self._mask_cache.get(segment.seq)
+        if mask is None:
+            mask = np.fromiter(
+                (row_id for row_id, seq in self._tombstones.items() if seq > segment.seq), dtype="int64"
+            )
+            self._mask_cache[segment.seq] = mask
+        return mask
+
+
+    #* add vectors under the given row ids
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        ids = np.asarray(list(ids), dtype="int64")
+        if len(ids) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(len(ids), self.dimension)
+        with self.lock:
+            self._active.index.add_with_ids(vectors, ids)
+            self._dirty = True
+            self._maybe_compact()
+
+
+    #* drop vectors by row id, returns how many were removed
+    def remove(self, ids: Iterable[int]) -> int:
+        ids = np.asarray(list(ids), dtype="int64")
+        if len(ids) == 0:
+            return 0
+        with self.lock:
+            removed = int(self._active.index.remove_ids(ids)) if self._active.index.ntotal else 0
+
+            #? written segments are immutable: mask their copies from the current sequence on
+            previous = np.fromiter((self._tombstones.get(int(i), 0) for i in ids), dtype="int64", count=len(ids))
+            hit = np.zeros(len(ids), dtype=bool)
+            for segment in self._segments:
+                live = _contains(segment.ids, ids) & (previous <= segment.seq)
+                removed += int(live.sum())
+                self._masked += int(live.sum())
+                hit |= live
+            if hit.any():
+                for row_id in ids[hit]:
+                    self._tombstones[int(row_id)] = self._active.seq
+                self._mask_cache = {}
+
+            if removed:
+                self._dirty = True
+                self._maybe_compact()
+            return removed
+
+
+    #* swap the vectors stored under existing ids
+    def replace(self, ids: Iterable[int], vectors: np.ndarray):
+        ids = list(ids)
+        with self.lock:
+            self.remove(ids)
+            self.add(ids, vectors)
+
+
+    #? `selectivity` is the share of the segment the filter keeps, 0 asks for an exhaustive search
+    def _search_params(self, index, selector, selectivity: float = 1.0):
+        inner = self._inner(index)
+        if isinstance(inner, faiss.IndexHNSW):
+            ef = inner.hnsw.efSearch
+            if selectivity < 1.0:
+                ef = min(_MAX_FILTERED_EF, max(ef, math.ceil(ef / max(selectivity, 1e-9))))
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=ef)
+        if isinstance(inner, faiss.IndexIVF):
+            nprobe = inner.nprobe
+            if selectivity <= 0.0:
+                nprobe = inner.nlist
+            elif selectivity < 1.0:
+                nprobe = min(inner.nlist, max(nprobe, math.ceil(nprobe / selectivity)))
+            return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+        return faiss.SearchParameters(sel=selector)
+
+
+    #? brute force over the given rows, vectors come from the index (reconstructed) or are given
+    def _exact_search(self, index, query: np.ndarray, ids: np.ndarray, k: int, vectors: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if vectors is None:
+            vectors = index.reconstruct_batch(ids)
+        vectors = vectors.reshape(len(ids), self.dimension)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(distances, kind="stable")[:k]
+        return distances[order].astype("float32"), ids[order]
+
+
+    #* nearest neighbours of one query vector as (distances, ids), missing slots dropped
+    #* `ids` (an IdFilter, or any ids) restricts the search to those rows inside FAISS (no post-filtering)
+    def search(self, query: np.ndarray, k: int, ids: Optional[Iterable[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        query = np.ascontiguousarray(query, dtype="float32").reshape(1, self.dimension)
+        id_filter = allowed = None
+        if ids is not None:
+            id_filter = ids if isinstance(ids, IdFilter) else IdFilter(ids)
+            allowed = id_filter.ids
+            if len(allowed) == 0:
+                return np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+            k = min(k, len(allowed))
+
+        with self.lock:
+            if self.ntotal == 0 or k <= 0:
+                return np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+
+            #? selectors only hold pointers, keep every part referenced until the searches ran
+            allowed_sel = id_filter.selector if id_filter is not None else None
+            keep_alive = []
+            all_distances, all_ids = [], []
+            #? allowed rows of ivf-pq segments, ranked on their stored vectors once the lock is released
+            exact_rows = []
+            for segment in self._segments + [self._active]:
+                if segment.index.ntotal == 0:
+                    continue
+                mask = self._segment_mask(segment) if segment is not self._active else ()
+                kind = self._kind_of(segment.index) if segment is not self._active else "flat"
+
+                selectivity = 1.0
+                if allowed is not None and kind != "flat":
+                    #? live allowed rows of this segment decide between exact and widened search
+                    here = id_filter._in_segment(segment)
+                    if len(mask):
+                        here = here[~np.isin(here, mask)]
+                    if len(here) == 0:
+                        continue
+                    if len(here) <= self.exact_filter_limit:
+                        if kind == "hnsw":
+                            distances, found = self._exact_search(segment.index, query[0], here, k)
+                            all_distances.append(distances)
+                            all_ids.append(found)
+                            continue
+                        if self.vector_source is not None:
+                            exact_rows.append(here)
+                            continue
+                        selectivity = 0.0
+                    else:
+                        selectivity = len(here) / len(segment.ids)
+
+                selector = allowed_sel
+                if len(mask):
+                    masked_sel = faiss.IDSelectorNot(faiss.IDSelectorBatch(mask))
+                    keep_alive.append(masked_sel)
+                    selector = masked_sel if selector is None else faiss.IDSelectorAnd(selector, masked_sel)
+                    keep_alive.append(selector)
+                if segment is not self._active and segment.index.ntotal > len(segment.ids):
+                    #? relabelled (dead) nodes of an appended graph must not take result slots
+                    labelled_sel = faiss.IDSelectorRange(0, np.iinfo("int64").max)
+                    keep_alive.append(labelled_sel)
+                    selector = labelled_sel if selector is None else faiss.IDSelectorAnd(selector, labelled_sel)
+                    keep_alive.append(selector)
+                params = self._search_params(segment.index, selector, selectivity) if selector is not None else None
+                distances, found = segment.index.search(query, min(k, segment.index.ntotal), params=params)
+                all_distances.append(distances[0])
+                all_ids.append(found[0])
+
+        if exact_rows:
+            source_ids, vectors = self.vector_source(np.concatenate(exact_rows))
+            source_ids = np.asarray(source_ids, dtype="int64")
+            distances, found = self._exact_search(None, query[0], source_ids, k, np.asarray(vectors, dtype="float32"))
+            all_distances.append(distances)
+            all_ids.append(found)
+
+        if not all_ids:
+            return np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+        distances, found = np.concatenate(all_distances), np.concatenate(all_ids)
+        keep = found >= 0
+        distances, found = distances[keep], found[keep]
+        order = np.argsort(distances, kind="stable")[:k]
+        return distances[order], found[order]
+
+
+    #* throw the current content away and index the given rows
+    def rebuild(self, ids: Iterable[int], vectors: np.ndarray):
+        ids = np.asarray(list(ids), dtype="int64")
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(len(ids), self.dimension)
+        with self.lock:
+            self._generation += 1
+            self._build_thread = None
+            self._side_thread = None
+            self._build_targets, self._side_targets = [], []
+            self._retry_at = 0
+            seq = self._active.seq
+            base = self._new_flat()
+            if len(ids):
+                base.add_with_ids(vectors, ids)
+            self._segments = [_Segment(seq, base, np.sort(ids))] if len(ids) else []
+            self._tombstones = {}
+            self._recount_masked()
+            self._open_active(seq + 1)
+            self._dirty = True
+            self._maybe_compact()
+
+
+    #? called under the lock after every write
+    def _maybe_compact(self):
+        if not self._segments:
+            return
+        if self._build_thread is not None:
+            #? the running merges own the segments they started with, newer ones can still be folded
+            busy = self._build_targets + self._side_targets
+            pending = [segment for segment in self._segments if segment not in busy]
+            if self._side_thread is None and len(pending) > 1 and len(self._segments) > self.max_segments:
+                self._side_targets = pending
+                self._side_thread = threading.Thread(
+                    target=self._merge, args=(pending, self._generation, False, "side"),
+                    name="vector-index-merge", daemon=True
+                )
+                self._side_thread.start()
+            elif len(pending) > self.max_segments:
+                #? small flat deltas: cheap enough to fold in place of waiting for the side merge
+                self._merge(pending, self._generation, False, None)
+            return
+
+        base, deltas = self._segments[0], self._segments[1:]
+        base_kind = self._kind_of(base.index)
+        live = self.ntotal
+        delta_size = sum(len(segment.ids) for segment in deltas)
+        promote = (
+            self.ann_kind != "flat"
+            and base_kind == "flat"
+            and live >= max(self.ann_threshold, self._retry_at)
+        )
+        #? rows relabelled out of an appended hnsw graph still take space in it
+        dead = self._masked + sum(segment.index.ntotal - len(segment.ids) for segment in self._segments)
+        retrain = promote or dead > self.tombstone_ratio * max(live, 1)
+        major = (
+            retrain
+            or (deltas and delta_size >= len(base.ids))
+            or (deltas and self.compact_interval and time.time() - self._last_compaction > self.compact_interval)
+        )
+        append = False
+        if major:
+            targets = list(self._segments)
+            #? an ann base takes the deltas in as they are, training it again is left to `retrain`
+            append = base_kind != "flat" and not retrain and len(targets) > 1
+        elif len(self._segments) > self.max_segments:
+            #? minor merge: fold the small deltas together, the base stays as it is
+            targets = list(deltas)
+        else:
+            return
+        if not append and self._kind_of(targets[0].index) == "ivfpq" and self.vector_source is None:
+            return
+
+        self._build_targets = targets
+        self._build_thread = threading.Thread(
+            target=self._merge, args=(targets, self._generation, append), name="vector-index-merge", daemon=True
+        )
+        self._build_thread.start()
+
+
+    #? live (ids, vectors) of written segments as they were when the merge started
+    def _collect(self, targets: List[_Segment], masks: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        all_ids, all_vectors = [], []
+        source = None
+        for segment, mask in zip(targets, masks):
+            if self._kind_of(segment.index) == "ivfpq":
+                #? pq codes are lossy: take the stored vectors of the same rows from the owner
+                if source is None:
+                    source_ids, source_vectors = self.vector_source()
+                    source_ids = np.asarray(source_ids, dtype="int64")
+                    source = (source_ids, np.asarray(source_vectors, dtype="float32"), np.argsort(source_ids))
+                source_ids, source_vectors, order = source
+                positions = np.searchsorted(source_ids, segment.ids, sorter=order).clip(max=max(len(source_ids) - 1, 0))
+                found = source_ids[order[positions]] == segment.ids if len(source_ids) else np.zeros(len(segment.ids), bool)
+                ids = segment.ids[found]
+                vectors = source_vectors[order[positions[found]]]
+            else:
+                ids = faiss.vector_to_array(segment.index.id_map).astype("int64")
+                vectors = segment.index.index.reconstruct_n(0, segment.index.ntotal)
+                if len(ids) != len(segment.ids):
+                    #? negative labels are rows relabelled out of an appended graph
+                    ids, vectors = ids[ids >= 0], vectors[ids >= 0]
+            if len(mask):
+                live = ~np.isin(ids, mask)
+                ids, vectors = ids[live], vectors[live]
+            all_ids.append(ids)
+            all_vectors.append(vectors.reshape(len(ids), self.dimension))
+        return np.concatenate(all_ids), np.ascontiguousarray(np.vstack(all_vectors), dtype="float32")
+
+
+    def _train(self, kind: str, vectors: np.ndarray):
+        n = len(vectors)
+        if kind == "hnsw":
+            inner = faiss.IndexHNSWFlat(self.dimension, 32)
+            inner.hnsw.efConstruction = 80
+            return faiss.IndexIDMap2(inner)
+
+        #? ~4*sqrt(n) lists, 4 dimensions per PQ sub-quantizer (8 bits each)
+        nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))
+        m = next(m for m in (self.dimension // 4, 64, 48, 32, 16, 8, 4, 2, 1) if m and self.dimension % m == 0)
+        quantizer = faiss.IndexFlatL2(self.dimension)
+        inner = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, m, 8)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(n, min(n, nlist * 64), replace=False)]
+        inner.train(sample)
+        #? no id map around ivf: IndexIDMap2.remove_ids assumes the inner index renumbers its rows
+        return inner
+
+
+    #? smallest efSearch / nprobe reaching the recall target against exact search
+    def _tune(self, index, ids: np.ndarray, vectors: np.ndarray) -> float:
+        n = len(ids)
+        k = min(10, n)
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(n, min(n, self.recall_queries), replace=False)]
+        _, truth = faiss.knn(queries, vectors, k)
+        truth_ids = ids[truth]
+
+        inner = self._inner(index)
+        if isinstance(inner, faiss.IndexHNSW):
+            steps = [("efSearch", value) for value in _EF_SEARCH_STEPS]
+        else:
+            steps = [("nprobe", value) for value in _NPROBE_STEPS if value <= inner.nlist] or [("nprobe", inner.nlist)]
+
+        recall = 0.0
+        for name, value in steps:
+            if name == "efSearch":
+                inner.hnsw.efSearch = value
+            else:
+                inner.nprobe = value
+            _, found = index.search(queries, k)
+            recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth_ids)]))
+            if recall >= self.min_recall:
+                break
+        return recall
+
+
+    @staticmethod
+    def _save_ids(path: str, ids: np.ndarray):
+        with open(path, "wb") as f:
+            np.save(f, ids)
+
+
+    #? write a segment's index and id list under a fresh name
+    def _write_segment(self, seq: int, index, sorted_ids: np.ndarray) -> str:
+        os.makedirs(self.dir, exist_ok=True)
+        name = f"seg-{seq:06d}-{time.time_ns():x}.index"
+        _write_atomic(os.path.join(self.dir, name), lambda tmp: faiss.write_index(index, tmp))
+        _write_atomic(os.path.join(self.dir, name + ".ids.npy"), lambda tmp: self._save_ids(tmp, sorted_ids))
+        return name
+
+
+    #? private copy of an ann base with the live delta rows added, dead base rows taken out
+    def _append(self, base: _Segment, base_mask: np.ndarray, deltas: List[_Segment], masks: List[np.ndarray]):
+        #? a mapped index only views its file, the copy is read (or serialized) into memory
+        if base.name is not None:
+            index = faiss.read_index(os.path.join(self.dir, base.name))
+        else:
+            index = faiss.deserialize_index(faiss.serialize_index(base.index))
+
+        dead = base.ids[np.isin(base.ids, base_mask)] if len(base_mask) else np.empty(0, dtype="int64")
+        if len(dead):
+            if hasattr(index, "id_map"):
+                #? hnsw cannot delete nodes: a unique negative label keeps them out of every result
+                labels = faiss.vector_to_array(index.id_map).astype("int64")
+                positions = np.flatnonzero(np.isin(labels, dead))
+                labels[positions] = -(positions + 1)
+                faiss.copy_array_to_vector(labels, index.id_map)
+                index.construct_rev_map()
+            else:
+                index.remove_ids(dead)
+
+        ids, vectors = self._collect(deltas, masks)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        live_base = base.ids[~np.isin(base.ids, dead)] if len(dead) else base.ids
+        return index, np.concatenate([live_base, ids])
+
+
+    #? background merge of `targets` into one segment numbered like the newest of them
+    #? `slot` is the thread running it: "build", "side" (next to the build) or None (inline, under the lock)
+    def _merge(self, targets: List[_Segment], generation: int, append: bool = False, slot: Optional[str] = "build"):
+        try:
+            with self.lock:
+                masks = [self._segment_mask(segment) for segment in targets]
+                includes_base = targets[0] is self._segments[0]
+            seq = targets[-1].seq
+
+            index, kind, recall = None, "flat", None
+            if append:
+                index, ids = self._append(targets[0], masks[0], targets[1:], masks[1:])
+                kind = self._kind_of(index)
+            else:
+                ids, vectors = self._collect(targets, masks)
+            if index is None and includes_base and self.ann_kind != "flat" and len(ids) >= max(self.ann_threshold, self._retry_at):
+                index = self._train(self.ann_kind, vectors)
+                index.add_with_ids(vectors, ids)
+                recall = self._tune(index, ids, vectors)
+                if recall >= self.min_recall:
+                    kind = self.ann_kind
+                else:
+                    #? keep a flat base, try again once the collection doubled
+                    print(f"Keeping a flat index for {self.dir}: {self.ann_kind} recall {recall:.3f} < {self.min_recall}")
+                    self._retry_at = len(ids) * 2
+                    index = None
+            if index is None:
+                index = self._new_flat()
+                if len(ids):
+                    index.add_with_ids(vectors, ids)
+
+            #? written before the swap, the manifest only points at it afterwards
+            sorted_ids = np.sort(ids)
+            name = self._write_segment(seq, index, sorted_ids)
+            if self.mmap:
+                index = self._read(os.path.join(self.dir, name))
+        except Exception as e:
+            print(f"Vector index merge failed for {self.dir}: {e}")
+            with self.lock:
+                if generation == self._generation:
+                    self._finish_merge(slot)
+                    if slot == "build":
+                        self._retry_at = self.ntotal * 2
+            return
+
+        with self.lock:
+            if generation != self._generation:
+                return
+            self._finish_merge(slot)
+            if any(segment not in self._segments for segment in targets):
+                return
+            start = self._segments.index(targets[0])
+            merged = _Segment(seq, index, sorted_ids, name)
+            self._segments[start:start + len(targets)] = [merged] if len(sorted_ids) else []
+            if start == 0:
+                #? tombstones older than the new base mask nothing anymore
+                self._tombstones = {row_id: t for row_id, t in self._tombstones.items() if t > seq}
+                self._last_compaction = time.time()
+            self._recount_masked()
+            if recall is not None and kind != "flat":
+                print(f"Switched {self.dir} to {kind} ({self.ntotal} vectors, recall@10 {recall:.3f})")
+            self._write_manifest()
+
+
+    def _finish_merge(self, slot: Optional[str]):
+        if slot == "side":
+            self._side_thread = None
+            self._side_targets = []
+        elif slot == "build":
+            self._build_thread = None
+            self._build_targets = []
+
+
+    #? turn the in-memory delta into a written segment
+    def _freeze(self):
+        active = self._active
+        if active.index.ntotal == 0:
+            return
+        active.ids = np.sort(faiss.vector_to_array(active.index.id_map).astype("int64"))
+        active.name = self._write_segment(active.seq, active.index, active.ids)
+        self._segments.append(active)
+        self._open_active(active.seq + 1)
+
+
+    def _write_manifest(self):
+        for segment in self._segments:
+            if segment.name is None:
+                #? built in memory (rebuild or a legacy file), written once
+                segment.name = self._write_segment(segment.seq, segment.index, segment.ids)
+
+        os.makedirs(self.dir, exist_ok=True)
+        tombstone_name = None
+        if self._tombstones:
+            tombstone_name = f"tombstones-{self._active.seq:06d}.npy"
+            pairs = np.array(list(self._tombstones.items()), dtype="int64").reshape(-1, 2)
+            _write_atomic(os.path.join(self.dir, tombstone_name), lambda tmp: self._save_ids(tmp, pairs))
+
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "dimension": self.dimension,
+            "next_seq": self._active.seq,
+            "segments": [
+                {"seq": segment.seq, "index": segment.name, "ids": segment.name + ".ids.npy"}
+                for segment in self._segments
+            ],
+            "tombstones": tombstone_name
+        }
+
+        def write(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+
+        _write_atomic(os.path.join(self.dir, MANIFEST_NAME), write)
+        self._remove_unreferenced(manifest)
+
+
+    #? files of merged segments and older tombstones, plus the single-file layout
+    def _remove_unreferenced(self, manifest: dict):
+        referenced = {MANIFEST_NAME, manifest["tombstones"]}
+        for entry in manifest["segments"]:
+            referenced.update((entry["index"], entry["ids"]))
+        stale = [
+            os.path.join(self.dir, name) for name in os.listdir(self.dir)
+            if name not in referenced and not (
+                name.endswith(".tmp") or (self._build_thread or self._side_thread) and name.startswith("seg-")
+            )
+        ]
+        stale += [path for path in (self.path, self.path + ".pending", self.path + ".deleted.npy") if os.path.exists(path)]
+        for path in stale:
+            try:
+                os.remove(path)
+            except OSError:
+                #? still mapped on some platforms, retried on the next save
+                pass
+
+
+    #* persist the delta as a new segment and point the manifest at it
+    def save(self):
+        with self.lock:
+            if not self._dirty:
+                return
+            self._freeze()
+            self._write_manifest()
+            #? only here: a merge rewrites the manifest too but leaves the delta in memory
+            self._dirty = False
+            self._maybe_compact()
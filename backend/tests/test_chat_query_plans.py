@@ -0,0 +1,86 @@
+import inspect
+import re
+
+import pytest
+
+from services.chat_services import ChatServices
+
+#? queries that match inside the text (LIKE '%q%') and cannot use a b-tree index
+SCAN_ALLOWED = {"search_for_chat", "fetch_media_content"}
+
+#? "SCAN messages" (or "SCAN TABLE messages" before SQLite 3.36) is a full table scan,
+#? "SCAN messages USING INDEX ..." walks an index in order and fts5 reports "VIRTUAL TABLE INDEX"
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(?!TABLE )(\w+)(?!\w| USING | VIRTUAL TABLE )")
+
+
+@pytest.fixture
+def chat(tmp_path):
+    service = ChatServices(db_path=str(tmp_path / "chat_data.db"))
+    yield service
+    service.close()
+
+
+#* run every public ChatServices method and record the SQL each one sends
+def _exercise(chat):
+    captured = {}
+    current = [None]
+    conn = chat.db.connection()
+    conn.set_trace_callback(lambda sql: captured.setdefault(current[0], []).append(sql))
+
+    def run(name, *args):
+        current[0] = name
+        try:
+            return getattr(chat, name)(*args)
+        except ValueError:
+            #? the "nothing found" errors still ran their query
+            return None
+
+    chat_id = run("create_new_entry", "Plans")[0]["id"]
+    messages = run("create_new_message_entry", "hello [BLOCK:{\"type\": \"links\"}]", "hi there", chat_id)
+    user_id = messages["user_message"][0]["id"]
+    reply_id = messages["assistant_message"][0]["id"]
+
+    run("update_chat_title", chat_id, "Query plans")
+    run("load_chats_list")
+    run("toggle_archive_chat", chat_id, False)
+    run("search_for_chat", "plans")
+    run("load_all_archived_chats")
+    run("save_chat_locally", chat_id)
+    run("get_context_for_regeneration", chat_id, user_id)
+    run("regenerate_message", chat_id, "hello", "hi again", user_id, reply_id)
+    run("get_all_regenerate_for_message", reply_id)
+    run("load_all_chat_messages", chat_id)
+    run("load_n_chat_messages", chat_id, 5)
+    run("search_for_message", "hello")
+    run("toggle_archive_message", reply_id, False)
+    run("load_all_archived_messages")
+    run("fetch_media_content")
+    run("delete_chat_entry", chat_id)
+
+    conn.set_trace_callback(None)
+    return captured
+
+
+def test_every_method_is_exercised(chat):
+    public = {
+        name for name, _ in inspect.getmembers(ChatServices, inspect.isfunction)
+        if not name.startswith("_") and name != "close"
+    }
+    assert public == set(_exercise(chat))
+
+
+def test_queries_use_indexes(chat):
+    conn = chat.db.connection()
+    failures = []
+    for method, statements in _exercise(chat).items():
+        if method in SCAN_ALLOWED:
+            continue
+        for sql in statements:
+            if not re.match(r"\s*(SELECT|UPDATE|DELETE)\b", sql, re.IGNORECASE):
+                continue
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+            for step in plan:
+                if FULL_SCAN.match(step) or "USE TEMP B-TREE" in step:
+                    failures.append(f"{method}: {step}\n    {' '.join(sql.split())}")
+
+    assert not failures, "unindexed queries:\n" + "\n".join(failures)
@@ -0,0 +1,20 @@
+import re
+
+# Runs of word characters, FTS5 syntax (quotes, AND/OR/NOT, NEAR, *, :, ^, ...) never survives
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def build_fts_query(text: str, prefix_last: bool = False, operator: str = "OR"):
+    """
+    Turn free user text into a safe FTS5 MATCH expression: every token is quoted
+    and the tokens are joined with `operator`. With `prefix_last` the last token
+    also matches as a prefix (search-as-you-type). Returns None when nothing is left.
+    """
+    tokens = _TOKEN_PATTERN.findall(text or "")
+    if not tokens:
+        return None
+
+    terms = [f'"{token}"' for token in tokens]
+    if prefix_last:
+        terms[-1] += "*"
+    return f" {operator} ".join(terms)
@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence
+
+
+class _Request:
+    def __init__(self, items: List):
+        self.items = items
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Worker thread that merges concurrent calls into batches.
+    `submit` queues a list of items and blocks for their results; the worker waits
+    at most `max_wait_ms` after the first request for more items, up to
+    `max_batch_size`, then calls `process` once with every item and hands each
+    caller back its own slice. An error from `process` fails the whole batch.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List], Sequence],
+        max_batch_size: int,
+        max_wait_ms: float,
+        name: str,
+        closed_message: str
+    ):
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.closed_message = closed_message
+
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+
+    #* results for `items`, blocks until the batch holding them is done
+    def submit(self, items: List) -> Sequence:
+        if self._closed:
+            raise RuntimeError(self.closed_message)
+        request = _Request(items)
+        self._queue.put(request)
+        return request.future.result()
+
+
+    #* worker loop collecting requests into micro-batches
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._fail_pending()
+                return
+
+            batch = [first]
+            size = len(first.items)
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                size += len(item.items)
+
+            self._process_batch(batch)
+            if stop:
+                self._fail_pending()
+                return
+
+
+    def _process_batch(self, batch: List[_Request]):
+        items = [item for request in batch for item in request.items]
+        try:
+            results = self.process(items)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        #? hand every caller back its own slice
+        offset = 0
+        for request in batch:
+            count = len(request.items)
+            request.future.set_result(results[offset:offset + count])
+            offset += count
+
+
+    #? requests that raced with close() would otherwise wait forever
+    def _fail_pending(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                item.future.set_exception(RuntimeError(self.closed_message))
+
+
+    def close(self, timeout: float = 5):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout=timeout)
@@ -0,0 +1,11 @@
+import functools
+
+
+def synchronized(method):
+    #? serialize calls on the instance lock so a single service object can be
+    #? shared by every request thread
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
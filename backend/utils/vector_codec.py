@@ -0,0 +1,105 @@
+import io
+import pickle
+import sqlite3
+from typing import Tuple
+
+import numpy as np
+
+#? version 0: pickle.dumps(np.ndarray) per row
+#? version 1: raw little-endian float32 / float16 bytes, dtype recorded in vector_meta
+VECTOR_FORMAT_VERSION = 1
+
+VECTOR_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2")
+}
+
+
+def encode_vector(vector, dtype: str = "float32") -> bytes:
+    return np.asarray(vector).astype(VECTOR_DTYPES[dtype], copy=False).tobytes()
+
+
+def decode_vector(blob: bytes, dtype: str = "float32") -> np.ndarray:
+    #? read-only view on the blob, no copy
+    return np.frombuffer(blob, dtype=VECTOR_DTYPES[dtype])
+
+
+class _NumpyUnpickler(pickle.Unpickler):
+    #? legacy blobs only ever hold an ndarray, refuse anything else
+    ALLOWED = {
+        ("numpy", "ndarray"),
+        ("numpy", "dtype"),
+        ("numpy.core.multiarray", "_reconstruct"),
+        ("numpy._core.multiarray", "_reconstruct"),
+        ("numpy.core.multiarray", "scalar"),
+        ("numpy._core.multiarray", "scalar")
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a vector blob")
+        return super().find_class(module, name)
+
+
+def decode_legacy_vector(blob: bytes) -> np.ndarray:
+    return np.asarray(_NumpyUnpickler(io.BytesIO(blob)).load())
+
+
+def load_matrix(
+    conn: sqlite3.Connection,
+    table: str,
+    dimension: int,
+    dtype: str = "float32",
+    column: str = "embedding",
+    id_column: str = "id",
+    where: str = "",
+    params: tuple = ()
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Read a whole vector column into (ids, one contiguous float32 matrix)"""
+    query = f"SELECT {id_column}, {column} FROM {table} {where} ORDER BY {id_column}"
+    rows = conn.execute(query, params).fetchall()
+    if not rows:
+        return np.empty(0, dtype="int64"), np.empty((0, dimension), dtype="float32")
+
+    ids = np.fromiter((row[0] for row in rows), dtype="int64", count=len(rows))
+    matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=VECTOR_DTYPES[dtype]).reshape(len(rows), dimension)
+    return ids, matrix.astype("float32", copy=False)
+
+
+def _get_meta(conn: sqlite3.Connection, key: str):
+    row = conn.execute("SELECT value FROM vector_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value):
+    conn.execute("INSERT OR REPLACE INTO vector_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def migrate_vector_table(conn: sqlite3.Connection, table: str, dtype: str = "float32", column: str = "embedding", id_column: str = "id") -> int:
+    """
+    One-shot upgrade of a vector column to the current storage format.
+    Needs the `vector_meta` table; rows already in the right format are left alone.
+    Returns the number of rewritten rows.
+    """
+    version = int(_get_meta(conn, f"{table}.format_version") or 0)
+    stored_dtype = _get_meta(conn, f"{table}.dtype") or "float32"
+    if version == VECTOR_FORMAT_VERSION and stored_dtype == dtype:
+        return 0
+
+    rows = conn.execute(f"SELECT {id_column}, {column} FROM {table} WHERE {column} IS NOT NULL").fetchall()
+    updates = []
+    for row_id, blob in rows:
+        if version == 0:
+            vector = decode_legacy_vector(blob)
+        else:
+            vector = decode_vector(blob, stored_dtype)
+        updates.append((encode_vector(vector, dtype), row_id))
+
+    with conn:
+        conn.executemany(f"UPDATE {table} SET {column} = ? WHERE {id_column} = ?", updates)
+        _set_meta(conn, f"{table}.format_version", VECTOR_FORMAT_VERSION)
+        _set_meta(conn, f"{table}.dtype", dtype)
+
+    if updates:
+        print(f"Migrated {len(updates)} vectors in {table} to format v{VECTOR_FORMAT_VERSION} ({dtype})")
+    return len(updates)
@@ -13,9 +13,9 @@ async function send_rag_candidate_to_db(formData: FormData) {
         }
         const data = await response.json();
         if (data.status === 'success') {
-            return {success:true, data:"Completed"}; 
+            return {success:true, data:data.job_id}; 
         }
-        return data;
+        return {success:false, data:data.message};
     } catch (error) {
         console.error('Error fetching specified chat messages:', error);
         return {"success":false, "data":error};
@@ -23,6 +23,33 @@ async function send_rag_candidate_to_db(formData: FormData) {
 }
 
 
+//? job states after which the file is indexed (or never will be)
+const FINISHED_JOB_STATES = ["done", "duplicate", "failed", "cancelled"]
+
+async function wait_for_rag_job(job_id: string, interval: number = 500) {
+    try {
+        //? poll the ingestion job until the worker is done with it
+        while (true) {
+            const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/rag/jobs/${job_id}`);
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            const data = await response.json();
+            if (data.status !== 'success') {
+                return {success:false, data:data.message};
+            }
+            if (FINISHED_JOB_STATES.includes(data.job.status)) {
+                return {success:data.job.status === "done" || data.job.status === "duplicate", data:data.job};
+            }
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    } catch (error) {
+        console.error('Error waiting for rag job:', error);
+        return {"success":false, "data":error};
+    }
+}
+
+
 async function load_all_files_db() {
     try {
         
@@ -60,4 +87,4 @@ async function delete_rag_file(file_id:number) {
 
 
 
-export {send_rag_candidate_to_db, load_all_files_db,delete_rag_file}
\ No newline at end of file
+export {send_rag_candidate_to_db, wait_for_rag_job, load_all_files_db,delete_rag_file}
\ No newline at end of file